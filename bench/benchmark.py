@@ -0,0 +1,210 @@
+"""
+End-to-end throughput benchmark for `scrape()` and `scrape_to_json()`, run against the local mock API.
+
+Each scenario runs in its own process and working directory, so peak memory and on-disk state don't leak between
+runs. Results are printed as a table, and appended to `data/benchmarks.jsonl` so regressions can be tracked over time.
+
+    python -m bench.benchmark --sections items,npcs --pages 30 --latency 40
+    python -m bench.benchmark --set RATE_LIMIT.START=50 --set CONCURRENCY.PER_SECTION=4
+    python -m bench.benchmark --db    # Also benchmarks DB mode, see below
+
+DB mode loads with COPY into a `codex_bench` table, using HOST/PORT/USER/PASSWORD from your .env file. Point those at a
+local Postgres, not your Supabase project.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.mock_server import MockCodex  # noqa: E402
+
+SCENARIOS = ("json", "db")
+BENCH_TABLE = "codex_bench"
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    # ru_maxrss is in kilobytes on Linux, and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _apply_override(config: dict, override: str):
+    """Apply a `KEY.SUB=value` override. The value is parsed as JSON, and used as a string if that fails."""
+    path, _, raw = override.partition("=")
+    try:
+        value = json.loads(raw)
+    except json.JSONDecodeError:
+        value = raw
+    *parents, key = path.split(".")
+    target = config
+    for parent in parents:
+        target = target.setdefault(parent, {})
+    target[key] = value
+
+
+def run_scenario(scenario: str, settings: dict) -> dict:
+    """Runs inside the scenario's own process, with the working directory already set to a scratch folder"""
+    from tools import program_tools, table_tools
+    from tools.metrics_tools import Metrics
+
+    config = program_tools.load_config(os.path.join(ROOT, program_tools.CONFIG_FILE))
+    config.update({
+        "API_URL": settings["api_url"],
+        "SECTIONS": settings["sections"],
+        "INCREMENTAL": False,
+        "CACHE": {"ENABLED": False}
+    })
+    for override in settings["overrides"]:
+        _apply_override(config, override)
+
+    if scenario == "db":
+        from dotenv import load_dotenv
+        load_dotenv(os.path.join(ROOT, ".env"), override=True)
+        program_tools.Info.refresh()
+        config["DB_LOADER"] = {**config.get("DB_LOADER", {}), "MODE": "COPY", "TABLE": BENCH_TABLE}
+        pool = program_tools.get_db_pool(config)
+        connection = pool.getconn()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+                cursor.execute(f"CREATE TABLE {BENCH_TABLE} (guid TEXT PRIMARY KEY, section TEXT, data JSONB)")
+            connection.commit()
+        finally:
+            pool.putconn(connection)
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if scenario == "db":
+            stats = table_tools.scrape(config, interactive=False)
+        else:
+            stats = table_tools.scrape_to_json(config, output_dir="data", interactive=False)
+    seconds = time.perf_counter() - started
+    program_tools.close_clients()
+
+    pages = sum(section["pages"] for section in stats.values())
+    rows = sum(section["rows"] for section in stats.values())
+    counters = Metrics.snapshot()["counters"]
+    wire = sum(c["value"] for c in counters if c["name"] == "codex_http_wire_bytes_total")
+    body = sum(c["value"] for c in counters if c["name"] == "codex_http_body_bytes_total")
+    stages = {}
+    for section in stats.values():
+        for stage, spent in section["stages"].items():
+            stages[stage] = stages.get(stage, 0.0) + spent
+
+    return {
+        "scenario": scenario,
+        "pages": pages,
+        "rows": rows,
+        "seconds": seconds,
+        "pages_per_sec": pages / seconds if seconds else 0.0,
+        "rows_per_sec": rows / seconds if seconds else 0.0,
+        "peak_rss_mb": _peak_rss_mb(),
+        "wire_mb": wire / (1024 * 1024),
+        "body_mb": body / (1024 * 1024),
+        "stages": stages,
+        "sections": stats
+    }
+
+
+def _spawn(scenario: str, settings: dict) -> dict:
+    with tempfile.TemporaryDirectory(prefix=f"codex-bench-{scenario}-") as workdir:
+        completed = subprocess.run(
+            [sys.executable, "-m", "bench.benchmark", "--child", scenario, "--child-settings", json.dumps(settings)],
+            cwd=workdir, env={**os.environ, "PYTHONPATH": ROOT}, capture_output=True, text=True
+        )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Scenario `{scenario}` failed:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_table(results: list):
+    print(f"\n{'scenario':<10}{'pages':>8}{'rows':>9}{'secs':>9}{'pages/s':>10}{'rows/s':>10}{'peak MB':>9}"
+          f"{'wire MB':>9}{'body MB':>9}{'fetch':>9}{'transform':>11}{'write':>9}")
+    for result in results:
+        stages = result["stages"]
+        peak = f"{result['peak_rss_mb']:.1f}" if result["peak_rss_mb"] is not None else "n/a"
+        print(f"{result['scenario']:<10}{result['pages']:>8}{result['rows']:>9}{result['seconds']:>9.2f}"
+              f"{result['pages_per_sec']:>10.1f}{result['rows_per_sec']:>10.1f}{peak:>9}"
+              f"{result['wire_mb']:>9.2f}{result['body_mb']:>9.2f}"
+              f"{stages.get('fetch', 0):>9.2f}{stages.get('transform', 0):>11.2f}{stages.get('write', 0):>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scraper against a local mock API")
+    parser.add_argument("--sections", default="items,abilities,npcs", help="comma separated sections to scrape")
+    parser.add_argument("--pages", type=int, default=20, help="pages per section")
+    parser.add_argument("--page-size", type=int, default=None, help="entities per page")
+    parser.add_argument("--latency", type=float, default=20.0, help="mock API latency in milliseconds")
+    parser.add_argument("--jitter", type=float, default=10.0, help="extra random latency in milliseconds")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--rate-timeout", type=float, default=0.0, help="share of requests that time out")
+    parser.add_argument("--no-compress", action="store_true", help="mock API ignores Accept-Encoding")
+    parser.add_argument("--set", dest="overrides", action="append", default=[], metavar="KEY.SUB=VALUE",
+                        help="override a config.json value for the run, e.g. CONCURRENCY.SECTIONS=4")
+    parser.add_argument("--db", action="store_true", help="also benchmark DB mode (COPY into a local Postgres)")
+    parser.add_argument("--history", default=os.path.join(ROOT, "data", "benchmarks.jsonl"),
+                        help="file the results are appended to")
+    parser.add_argument("--child", choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument("--child-settings", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_scenario(args.child, json.loads(args.child_settings))))
+        return
+
+    # Timeouts are held just past the scraper's timeout, so they cost seconds rather than minutes
+    overrides = ["HTTP.TIMEOUT=2", "HTTP.SECTION_TIMEOUTS={}"] + args.overrides
+    mock = MockCodex(pages=args.pages, page_size=args.page_size, latency=args.latency / 1000,
+                     jitter=args.jitter / 1000, rate_429=args.rate_429, rate_timeout=args.rate_timeout,
+                     timeout_delay=2.5, retry_after=1, compress=not args.no_compress)
+    settings = {
+        "api_url": mock.start(),
+        "sections": [section.strip() for section in args.sections.split(",") if section.strip()],
+        "overrides": overrides
+    }
+
+    results = []
+    try:
+        for scenario in ("json", "db") if args.db else ("json",):
+            print(f"Running `{scenario}` scenario...")
+            results.append(_spawn(scenario, settings))
+    finally:
+        mock.stop()
+
+    _print_table(results)
+    print(f"\nMock API served {mock.counts}")
+
+    os.makedirs(os.path.dirname(args.history) or ".", exist_ok=True)
+    with open(args.history, "a", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps({
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "revision": _git_revision(),
+                "params": {key: value for key, value in vars(args).items() if not key.startswith("child")},
+                **result
+            }) + "\n")
+    print(f"Results appended to {args.history}")
+
+
+if __name__ == "__main__":
+    main()
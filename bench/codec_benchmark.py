@@ -0,0 +1,65 @@
+"""
+Decode and encode timings for each installed JSON codec, on one of the example structures.
+
+    python -m bench.codec_benchmark
+    python -m bench.codec_benchmark --file example_structures/items.json --repeat 50
+
+`decode` parses the raw file bytes, the way `CodexApi.fetch_page` parses a response. `encode` and `encode-indent`
+serialize the parsed `data` list compact and with `indent=2`, the way the NDJSON/COPY and JSON exports do.
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tools import codec_tools  # noqa: E402
+
+
+def _best(repeat: int, call) -> float:
+    """Fastest of `repeat` runs, in milliseconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def run(path: str, repeat: int) -> list:
+    with open(path, "rb") as f:
+        raw = f.read()
+
+    results = []
+    for name in codec_tools.available_backends():
+        codec_tools.set_backend(name)
+        entries = codec_tools.loads(raw).get("data", [])
+        results.append({
+            "backend": name,
+            "decode": _best(repeat, lambda: codec_tools.loads(raw)),
+            "encode": _best(repeat, lambda: [codec_tools.dumps(entry) for entry in entries]),
+            "encode-indent": _best(repeat, lambda: [codec_tools.dumps(entry, indent=2) for entry in entries])
+        })
+    codec_tools.set_backend("auto")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the JSON codecs on an example structure")
+    parser.add_argument("--file", default=os.path.join(ROOT, "example_structures", "npcs.json"))
+    parser.add_argument("--repeat", type=int, default=20, help="runs per measurement, the fastest is kept")
+    args = parser.parse_args()
+
+    results = run(args.file, args.repeat)
+    print(f"{os.path.basename(args.file)}: {os.path.getsize(args.file) / 1024:.0f} KB, best of {args.repeat}\n")
+    print(f"{'backend':<10}{'decode ms':>12}{'encode ms':>12}{'indent ms':>12}{'decode x':>11}")
+    baseline = next(result["decode"] for result in results if result["backend"] == "json")
+    for result in results:
+        print(f"{result['backend']:<10}{result['decode']:>12.2f}{result['encode']:>12.2f}"
+              f"{result['encode-indent']:>12.2f}{baseline / result['decode']:>10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
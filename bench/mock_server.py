@@ -0,0 +1,253 @@
+"""
+Local stand-in for api.ashescodex.com, for benchmarking the scraper without touching the real API.
+
+Serves `/{section}?page=N` with pages built from `example_structures/{section}.json`. Every entity gets a guid that is
+unique to its page, so a run writes `pages * page_size` distinct entities. Pages past `--pages` come back with an
+empty `data` list, the same way the real API ends a section.
+
+    python -m bench.mock_server --pages 20 --latency 50 --rate-429 0.05
+
+Then point `API_URL` in config.json at the printed address.
+"""
+import argparse
+import copy
+import gzip
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+STRUCTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "example_structures")
+
+# Fields the scraper reads a guid from. Whichever of these an entity has is made unique per page.
+_ID_FIELDS = ("guid", "_id", "_slug")
+
+# Content-Encodings the mock can send, in the order it prefers them
+_ENCODERS = {"gzip": lambda body: gzip.compress(body, mtime=0)}
+if brotli is not None:
+    _ENCODERS["br"] = lambda body: brotli.compress(body, quality=5)
+if zstandard is not None:
+    _ENCODERS["zstd"] = lambda body: zstandard.ZstdCompressor().compress(body)
+_ENCODING_ORDER = ("zstd", "br", "gzip")
+
+
+class MockCodex:
+    """
+    pages:        Pages per section before the empty sentinel page.
+    page_size:    Entities per page. Defaults to however many the example structure holds.
+    latency:      Seconds added to every response, plus up to `jitter` seconds more.
+    rate_429:     Share of requests answered with 429 and a `Retry-After` of `retry_after` seconds.
+    rate_timeout: Share of requests held for `timeout_delay` seconds, to trip the scraper's timeout.
+    compress:     Answer with gzip, br or zstd when the request's Accept-Encoding allows it.
+    """
+
+    def __init__(self, pages: int = 10, page_size: int = None, latency: float = 0.0, jitter: float = 0.0,
+                 rate_429: float = 0.0, rate_timeout: float = 0.0, timeout_delay: float = 5.0,
+                 retry_after: float = 1.0, seed: int = 0, structures_dir: str = STRUCTURES_DIR,
+                 compress: bool = True):
+        self.pages = pages
+        self.page_size = page_size
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.rate_timeout = rate_timeout
+        self.timeout_delay = timeout_delay
+        self.retry_after = retry_after
+        self.structures_dir = structures_dir
+        self.compress = compress
+        self.counts = {"requests": 0, "429": 0, "timeouts": 0, "304": 0}
+        self._random = random.Random(seed)
+        self._samples = {}
+        self._bodies = {}
+        self._encoded = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def _sample(self, section: str):
+        with self._lock:
+            if section not in self._samples:
+                path = os.path.join(self.structures_dir, f"{section}.json")
+                if not os.path.isfile(path):
+                    self._samples[section] = None
+                else:
+                    with open(path, "r", encoding="utf-8") as f:
+                        document = json.load(f)
+                    # xp-tables is a single document rather than pages of `data`
+                    self._samples[section] = document.get("data", []) if "data" in document else document
+            return self._samples[section]
+
+    def body(self, section: str, page: int):
+        """The response body for one page, or None if the section doesn't exist"""
+        sample = self._sample(section)
+        if sample is None:
+            return None
+        if isinstance(sample, dict):
+            return json.dumps(sample, ensure_ascii=False).encode("utf-8")
+        if page < 1 or page > self.pages or not sample:
+            return b'{"data":[]}'
+
+        key = (section, page)
+        with self._lock:
+            if key in self._bodies:
+                return self._bodies[key]
+
+        entries = []
+        for i in range(self.page_size or len(sample)):
+            entry = copy.deepcopy(sample[i % len(sample)])
+            suffix = f"-p{page}-{i}"
+            unique = [field for field in _ID_FIELDS if entry.get(field)]
+            for field in unique:
+                entry[field] = f"{entry[field]}{suffix}"
+            if not unique:
+                entry["_id"] = f"{section}{suffix}"
+            entries.append(entry)
+
+        body = json.dumps({"data": entries}, ensure_ascii=False).encode("utf-8")
+        with self._lock:
+            self._bodies[key] = body
+        return body
+
+    def encode(self, section: str, page: int, body: bytes, accept_encoding: str):
+        """Compress `body` with the best encoding the client accepts. Returns `(body, encoding or None)`."""
+        if not self.compress:
+            return body, None
+        accepted = {encoding.split(";")[0].strip() for encoding in accept_encoding.split(",")}
+        encoding = next((name for name in _ENCODING_ORDER if name in accepted and name in _ENCODERS), None)
+        if encoding is None:
+            return body, None
+
+        key = (section, page, encoding)
+        with self._lock:
+            if key in self._encoded:
+                return self._encoded[key], encoding
+        encoded = _ENCODERS[encoding](body)
+        with self._lock:
+            self._encoded[key] = encoded
+        return encoded, encoding
+
+    def roll(self) -> str:
+        """Decide what kind of trouble, if any, the next request gets"""
+        with self._lock:
+            self.counts["requests"] += 1
+            roll = self._random.random()
+            if roll < self.rate_429:
+                self.counts["429"] += 1
+                return "429"
+            if roll < self.rate_429 + self.rate_timeout:
+                self.counts["timeouts"] += 1
+                return "timeout"
+            return "ok"
+
+    def delay(self) -> float:
+        with self._lock:
+            return self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Serve on a background thread. Returns the base URL to use as `API_URL`."""
+        self._server = ThreadingHTTPServer((host, port), _handler_for(self))
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="mock-codex", daemon=True).start()
+        return f"http://{host}:{self._server.server_address[1]}"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def _handler_for(mock: MockCodex):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_body(self, status: int, body: bytes = b"", headers: dict = None):
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            section = url.path.strip("/")
+            try:
+                page = int(parse_qs(url.query).get("page", ["1"])[0])
+            except ValueError:
+                return self.send_body(400)
+
+            outcome = mock.roll()
+            time.sleep(mock.delay())
+            if outcome == "429":
+                return self.send_body(429, headers={"Retry-After": str(mock.retry_after)})
+            if outcome == "timeout":
+                time.sleep(mock.timeout_delay)
+
+            body = mock.body(section, page)
+            if body is None:
+                return self.send_body(404)
+
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            if self.headers.get("If-None-Match") == etag:
+                with mock._lock:
+                    mock.counts["304"] += 1
+                return self.send_body(304, headers={"ETag": etag})
+            body, encoding = mock.encode(section, page, body, self.headers.get("Accept-Encoding", ""))
+            headers = {"Content-Type": "application/json", "ETag": etag}
+            if encoding is not None:
+                headers["Content-Encoding"] = encoding
+            self.send_body(200, body, headers)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Ashes Codex API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--pages", type=int, default=10, help="pages per section")
+    parser.add_argument("--page-size", type=int, default=None, help="entities per page")
+    parser.add_argument("--latency", type=float, default=0.0, help="milliseconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many more milliseconds, at random")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--rate-timeout", type=float, default=0.0, help="share of requests held past the timeout")
+    parser.add_argument("--timeout-delay", type=float, default=5.0, help="seconds a timed-out request is held")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After sent with a 429")
+    parser.add_argument("--no-compress", action="store_true", help="ignore Accept-Encoding and send plain JSON")
+    args = parser.parse_args()
+
+    mock = MockCodex(pages=args.pages, page_size=args.page_size, latency=args.latency / 1000,
+                     jitter=args.jitter / 1000, rate_429=args.rate_429, rate_timeout=args.rate_timeout,
+                     timeout_delay=args.timeout_delay, retry_after=args.retry_after, compress=not args.no_compress)
+    url = mock.start(args.host, args.port)
+    print(f"Mock Ashes Codex API listening on {url}  --  CTRL+C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
+        print(f"Served {mock.counts}")
+
+
+if __name__ == "__main__":
+    main()
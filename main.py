@@ -48,22 +48,30 @@ import colorama
 
 from tools import program_tools, table_tools, terminal_tools
 from tools.program_tools import Info
-config = program_tools.load_config(program_tools.CONFIG_FILE)
+from tools.sink_tools import SINKS
 
-# If no .env file, we create one.
-if not os.path.isfile(".env"):
-    with open(".env", "w") as f:
-        f.write(config["ENV_CONTENT"])
-    sys.exit("No valid .env file found! Creating one now... Please restart the program.")
+# Loaded by `main()`. Nothing runs at import time, as the transform processes import this module again.
+config = None
 
-load_dotenv(override=True)
-Info.refresh()
 
-# Validate info is correctly loaded after loading vars
-try:
-    Info.validate()
-except ValueError as e:
-    sys.exit(f"Configuration error while validating system variables: {e}")
+def load_environment():
+    global config
+    config = program_tools.load_config(program_tools.CONFIG_FILE)
+
+    # If no .env file, we create one.
+    if not os.path.isfile(".env"):
+        with open(".env", "w") as f:
+            f.write(config["ENV_CONTENT"])
+        sys.exit("No valid .env file found! Creating one now... Please restart the program.")
+
+    load_dotenv(override=True)
+    Info.refresh()
+
+    # Validate info is correctly loaded after loading vars
+    try:
+        Info.validate()
+    except ValueError as e:
+        sys.exit(f"Configuration error while validating system variables: {e}")
 
 
 def configure_sections():
@@ -162,7 +170,7 @@ def configure_database():
 
 def configure_method():
     configuring = True
-    options = ["DB", "JSON"]
+    options = list(SINKS)
     while configuring:
         terminal_tools.clear()
         print(config["TEXTS"]["BANNER"])
@@ -176,7 +184,7 @@ def configure_method():
         choice = input(f"\nMenu Option: > ")
         if choice == "0":
             configuring = False
-        elif choice in ("1", "2"):
+        elif choice.isdigit() and 1 <= int(choice) <= len(options):
             selected_method = options[int(choice) - 1]
             if config["SCRAPE_METHOD"] != selected_method:
                 config["SCRAPE_METHOD"] = selected_method
@@ -206,7 +214,8 @@ def configure():
 
 
 # TODO: Set this to run in it's own thread so we can listen for keystrokes and stop the program cleanly.
-if __name__ == "__main__":
+def main():
+    load_environment()
     # Colorama will set up systems to accept colorful terminals
     colorama.init()
     running = True
@@ -219,17 +228,21 @@ if __name__ == "__main__":
         match option:
             case "1":  # Scrape
                 input(config["TEXTS"]["VERIFY_TEXT"])
-                if config["SCRAPE_METHOD"] == "DB":
-                    table_tools.scrape()
-                elif config["SCRAPE_METHOD"] == "JSON":
-                    table_tools.scrape_to_json()
+                # Only the chosen method's sink, and the clients it needs, are imported
+                if scrape_meth in SINKS:
+                    try:
+                        table_tools.run_scrape()
+                    except RuntimeError as e:
+                        # A method whose optional package isn't installed, like PARQUET without pyarrow
+                        input(f"\033[0;31m{e}\033[0m\nPress ENTER to return to the main menu.")
                 else:
-                    input(f"\033[0;31mInvalid Configuration Option. Expected DB or JSON, "
+                    input(f"\033[0;31mInvalid Configuration Option. Expected {', '.join(SINKS)}, "
                           f"received {scrape_meth} Press ENTER to configure.\033[0m")
                     configure()
             case "2":  # Initialize Database
                 input(config["TEXTS"]["VERIFY_TEXT"])
-                configured = table_tools.create_table()
+                from tools import db_tools
+                configured = db_tools.create_table()
                 input(f"Database was {'not ' if not configured else ''}properly configured!")
             case "3":  # Config
                 configure()
@@ -237,6 +250,11 @@ if __name__ == "__main__":
                 input(config["TEXTS"]["HELP_TEXT"])
             case "0":  # Exit
                 print("Exiting program...")
+                program_tools.close_clients()
                 running = False
             case _:
                 print("Invalid option, please try again.")
+
+
+if __name__ == "__main__":
+    main()
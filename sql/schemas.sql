@@ -8,4 +8,41 @@ CREATE TABLE IF NOT EXISTS Codex (
     data JSONB
 );
 -- ###BREAK
--- Schema[2] etc
\ No newline at end of file
+-- Schema[2] Query-optimized. The scraper still writes guid, section and data. The other columns are generated from
+--      `data` by Postgres (12+), and kept up to date on every insert and update.
+--      display_name - itemName, abilityName, effectName, ... whichever name the section uses
+--      level        - level, _level or _certificationLevelMin, when it is a number
+--      ref_guids    - every guid in the entity (its own included), for "what references this?" lookups:
+--                     SELECT guid FROM codex WHERE ref_guids @> '["6064630141156262046"]';
+--      data is indexed with jsonb_path_ops, which serves containment (@>) and jsonpath (@?, @@) queries.
+--      Not partitioned by section: a partitioned table can't have a unique key on guid alone, and the scraper's
+--      upserts depend on ON CONFLICT (guid).
+CREATE TABLE IF NOT EXISTS Codex (
+    guid TEXT PRIMARY KEY,
+    section TEXT,
+    data JSONB,
+    display_name TEXT GENERATED ALWAYS AS (
+        COALESCE(data->>'itemName', data->>'abilityName', data->>'effectName', data->>'_characterName',
+                 data->>'_displayName', data->>'name')
+    ) STORED,
+    level NUMERIC GENERATED ALWAYS AS (
+        COALESCE(CASE WHEN jsonb_typeof(data->'level') = 'number' THEN (data->'level')::numeric END,
+                 CASE WHEN jsonb_typeof(data->'_level') = 'number' THEN (data->'_level')::numeric END,
+                 CASE WHEN jsonb_typeof(data->'_certificationLevelMin') = 'number'
+                      THEN (data->'_certificationLevelMin')::numeric END)
+    ) STORED,
+    type_id TEXT GENERATED ALWAYS AS (data->>'typeId') STORED,
+    slug TEXT GENERATED ALWAYS AS (data->>'_slug') STORED,
+    ref_guids JSONB GENERATED ALWAYS AS (
+        jsonb_path_query_array(data, 'strict $.**.guid ? (@ != "0")')
+    ) STORED
+);
+CREATE INDEX IF NOT EXISTS codex_section_idx ON Codex (section);
+CREATE INDEX IF NOT EXISTS codex_section_name_idx ON Codex (section, display_name);
+CREATE INDEX IF NOT EXISTS codex_section_level_idx ON Codex (section, level);
+CREATE INDEX IF NOT EXISTS codex_type_id_idx ON Codex (type_id);
+CREATE INDEX IF NOT EXISTS codex_slug_idx ON Codex (slug);
+CREATE INDEX IF NOT EXISTS codex_data_idx ON Codex USING GIN (data jsonb_path_ops);
+CREATE INDEX IF NOT EXISTS codex_ref_guids_idx ON Codex USING GIN (ref_guids jsonb_path_ops);
+-- ###BREAK
+-- Schema[3] etc
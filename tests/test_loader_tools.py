@@ -0,0 +1,136 @@
+"""
+CopyLoader's batch splitting and "last copy wins" merge. The merge tests need a Postgres to run against: set
+CODEX_TEST_DSN to a database they may create and drop a `codex_loader_test` table in.
+"""
+import os
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+from psycopg2 import errors
+import psycopg2.pool
+
+from tools import loader_tools
+from tools.loader_tools import CopyLoader
+from tools.transform_tools import EncodedRows
+
+
+def _entry(guid, value=0, section="items"):
+    return {"guid": guid, "section": section, "data": {"guid": guid, "value": value}}
+
+
+class FakeLoader(CopyLoader):
+    """Fails `merge()` for any batch holding a guid in `bad`, and keeps the batches that went through"""
+
+    def __init__(self, bad=(), error=psycopg2.DataError):
+        super().__init__(pool=None, max_retries=2)
+        self.bad = set(bad)
+        self.error = error
+        self.merged = []
+
+    def merge(self, entries) -> int:
+        if any(entry["guid"] in self.bad for entry in entries):
+            raise self.error("rejected")
+        self.merged.append([entry["guid"] for entry in entries])
+        return len(entries)
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(loader_tools.time, "sleep", lambda seconds: None)
+
+
+def test_copy_buffer_numbers_rows_in_order():
+    buffer = CopyLoader(pool=None).copy_buffer([_entry("b"), _entry("a\tb"), {"guid": None, "section": "items",
+                                                                                "data": {}}])
+    lines = buffer.read().decode("utf-8").splitlines()
+    assert [line.split("\t")[0] for line in lines] == ["0", "1", "2"]
+    assert lines[1].split("\t")[1] == "a\\tb"
+    assert lines[2].split("\t")[1] == "\\N"
+
+
+def test_copy_buffer_writes_encoded_rows_as_they_are():
+    entries = [_entry("b", 1), _entry("a\tb", 2), {"guid": None, "section": "items", "data": {}}]
+    loader = CopyLoader(pool=None)
+    assert loader.copy_buffer(EncodedRows.from_entries("items", entries)).read() == loader.copy_buffer(entries).read()
+
+
+def test_bad_entry_is_split_out_and_the_rest_is_loaded_in_order():
+    loader = FakeLoader(bad={"e3"})
+    entries = [_entry(f"e{i}") for i in range(8)]
+    failed = []
+
+    assert loader.load(entries, "items", 1, log=lambda message: None,
+                       failed=lambda code, rows: failed.append((code, rows))) is False
+    assert failed == [("N/A", [entries[3]])]
+    loaded = [guid for batch in loader.merged for guid in batch]
+    assert loaded == [f"e{i}" for i in range(8) if i != 3]
+
+
+def test_timeout_is_split_but_a_dropped_connection_is_not():
+    entries = [_entry(f"e{i}") for i in range(4)]
+
+    timeouts = FakeLoader(bad={"e0"}, error=errors.QueryCanceled)
+    failed = []
+    timeouts.load(entries, "items", 1, log=lambda message: None, failed=lambda code, rows: failed.append(rows))
+    assert failed == [[entries[0]]]
+
+    dropped = FakeLoader(bad={"e0"}, error=psycopg2.OperationalError)
+    failed = []
+    dropped.load(entries, "items", 1, log=lambda message: None,
+                 failed=lambda code, rows: failed.append((code, rows)))
+    assert failed == [("max_retries", entries)]
+    assert dropped.merged == []
+
+
+@pytest.fixture
+def database():
+    dsn = os.getenv("CODEX_TEST_DSN")
+    if not dsn:
+        pytest.skip("CODEX_TEST_DSN is not set")
+    pool = psycopg2.pool.SimpleConnectionPool(1, 2, dsn)
+    connection = pool.getconn()
+    with connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS codex_loader_test")
+        cursor.execute("CREATE TABLE codex_loader_test (guid TEXT PRIMARY KEY, section TEXT, data JSONB)")
+    connection.commit()
+    pool.putconn(connection)
+    yield pool
+
+    connection = pool.getconn()
+    with connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS codex_loader_test")
+    connection.commit()
+    pool.putconn(connection)
+    pool.closeall()
+
+
+def _stored(pool) -> dict:
+    connection = pool.getconn()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT guid, data->>'value' FROM codex_loader_test")
+            return dict(cursor.fetchall())
+    finally:
+        pool.putconn(connection)
+
+
+def test_merge_keeps_the_last_copy_of_a_guid(database):
+    loader = CopyLoader(database, table="codex_loader_test")
+    # Enough repeats that the copies spread over several heap pages
+    entries = [_entry(f"g{i % 50}", value=i) for i in range(5000)] + [_entry(None, value=-1)]
+
+    assert loader.load(entries, "items", 1, log=lambda message: None) is True
+    assert _stored(database) == {f"g{i}": str(4950 + i) for i in range(50)}
+
+
+def test_merge_splits_out_a_row_postgres_rejects(database):
+    loader = CopyLoader(database, table="codex_loader_test")
+    entries = [_entry(f"g{i}", value=i) for i in range(6)]
+    entries[4]["data"]["value"] = "bad \u0000 value"
+    failed = []
+
+    assert loader.load(entries, "items", 1, log=lambda message: None,
+                       failed=lambda code, rows: failed.append((code, rows))) is False
+    assert failed == [("22P05", [entries[4]])]
+    assert _stored(database) == {f"g{i}": str(i) for i in range(6) if i != 4}
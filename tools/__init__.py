@@ -1,3 +1,23 @@
-from .table_tools import *
-from .program_tools import *
-from .terminal_tools import *
\ No newline at end of file
+import importlib
+
+# `from tools import scrape` still works, but a module is only imported once one of its names is asked for.
+# Importing `tools` (or running `python -m tools.<module>`) no longer loads every client and backend up front.
+_EXPORTS = {
+    'table_tools': ('run_scrape', 'scrape', 'scrape_to_json', 'scrape_to_parquet', 'scrape_to_sqlite',
+                    'scrape_from_queue', 'seed_queue', 'replay_dead_letters'),
+    'db_tools': ('create_table',),
+    'program_tools': ('Info', 'get_supabase_client', 'get_http_session', 'get_db_pool', 'close_clients', 'API_URL',
+                      'CONFIG_FILE', 'COLOR_CODES', 'load_config', 'update_config'),
+    'terminal_tools': ('clear',)
+}
+_MODULES = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = tuple(_MODULES)
+
+
+def __getattr__(name):
+    if name not in _MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f"{__name__}.{_MODULES[name]}"), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,38 @@
+from tools import codec_tools
+
+__all__ = (
+    'dedupe_entries',
+    'plan_batches'
+)
+
+
+def dedupe_entries(entries: list):
+    """
+    Drop entries without a guid, and keep only the last copy of a repeated guid (a page can hold the same entity
+    twice, which Postgres rejects with 21000). Order is otherwise kept. Returns `(entries, dropped)`.
+    """
+    latest = {}
+    for position, entry in enumerate(entries):
+        if entry.get("guid"):
+            latest[entry["guid"]] = position
+    kept = [entries[position] for position in sorted(latest.values())]
+    return kept, len(entries) - len(kept)
+
+
+def plan_batches(entries: list, max_rows: int, max_bytes: int) -> list:
+    """
+    Split `entries` into batches of at most `max_rows` entries and roughly `max_bytes` of JSON each.
+    A single entry bigger than `max_bytes` still gets a batch of its own.
+    """
+    batches = []
+    batch, batch_bytes = [], 0
+    for entry in entries:
+        size = len(codec_tools.dumps(entry))
+        if batch and (len(batch) >= max_rows or batch_bytes + size > max_bytes):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(entry)
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
@@ -0,0 +1,126 @@
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+__all__ = (
+    'CACHE_DIR',
+    'CachedPage',
+    'ResponseCache'
+)
+
+CACHE_DIR = os.path.join("data", ".cache")
+
+
+@dataclass
+class CachedPage:
+    body: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+
+    def age(self) -> float:
+        return time.time() - self.fetched_at
+
+
+class ResponseCache:
+    """
+    On-disk cache of API responses, keyed by section and page, stored in SQLite.
+
+    ttl:       Seconds a page is served without asking the API. After that it is revalidated with
+               If-None-Match / If-Modified-Since, which costs a request but no download when nothing changed.
+    max_bytes: Once the cached bodies outgrow this, the least recently used pages are evicted.
+    offline:   Only ever serve from the cache. A page that isn't cached is an error.
+    """
+
+    def __init__(self, path: str, ttl: float = 86400, max_bytes: int = 1024 ** 3, offline: bool = False):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "section TEXT NOT NULL, page INTEGER NOT NULL, body BLOB NOT NULL, etag TEXT, last_modified TEXT, "
+                "fetched_at REAL NOT NULL, accessed_at REAL NOT NULL, size INTEGER NOT NULL, "
+                "PRIMARY KEY (section, page))"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed_at)")
+            self._size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+
+    @classmethod
+    def from_config(cls, config: dict) -> Optional["ResponseCache"]:
+        cache_config = config.get("CACHE", {})
+        if not cache_config.get("ENABLED") and not cache_config.get("OFFLINE"):
+            return None
+        return cls(
+            os.path.join(CACHE_DIR, "responses.sqlite"),
+            ttl=float(cache_config.get("TTL", 86400)),
+            max_bytes=int(float(cache_config.get("MAX_MB", 1024)) * 1024 * 1024),
+            offline=bool(cache_config.get("OFFLINE", False))
+        )
+
+    def get(self, section: str, page: int) -> Optional[CachedPage]:
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT body, etag, last_modified, fetched_at FROM pages WHERE section = ? AND page = ?",
+                (section, page)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE pages SET accessed_at = ? WHERE section = ? AND page = ?",
+                                     (time.time(), section, page))
+        return CachedPage(*row)
+
+    def is_fresh(self, cached: CachedPage) -> bool:
+        return self.offline or cached.age() < self.ttl
+
+    def conditional_headers(self, cached: Optional[CachedPage]) -> dict:
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+        return headers
+
+    def revalidated(self, section: str, page: int):
+        """The API answered 304 Not Modified. The cached page is good for another `ttl`."""
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE pages SET fetched_at = ? WHERE section = ? AND page = ?",
+                                     (time.time(), section, page))
+
+    def put(self, section: str, page: int, body: bytes, etag: Optional[str] = None,
+            last_modified: Optional[str] = None):
+        now = time.time()
+        with self._lock, self._connection:
+            previous = self._connection.execute("SELECT size FROM pages WHERE section = ? AND page = ?",
+                                                (section, page)).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO pages (section, page, body, etag, last_modified, fetched_at, accessed_at, size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (section, page, body, etag, last_modified, now, now, len(body))
+            )
+            self._size += len(body) - (previous[0] if previous else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Evict down to 90% of the limit, so we aren't evicting again on the very next page
+        target = self.max_bytes * 0.9
+        for section, page, size in self._connection.execute(
+                "SELECT section, page, size FROM pages ORDER BY accessed_at").fetchall():
+            if self._size <= target:
+                break
+            self._connection.execute("DELETE FROM pages WHERE section = ? AND page = ?", (section, page))
+            self._size -= size
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
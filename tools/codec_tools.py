@@ -0,0 +1,94 @@
+"""
+One place to parse and emit JSON. Uses orjson or msgspec when either is installed, and the stdlib otherwise.
+
+All backends decode straight from response bytes and encode to UTF-8 bytes, so no intermediate `str` is built.
+Anything a fast backend can't handle (orjson only indents by 2, neither encodes integers past 64 bits, ...) falls back
+to the stdlib for that call only. The layout is the same as `json.dumps(..., ensure_ascii=False)` whichever backend
+runs, except that orjson and msgspec write float exponents without the `+` (`3.4e38` rather than `3.4e+38`).
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+__all__ = (
+    'BACKENDS',
+    'available_backends',
+    'backend',
+    'set_backend',
+    'loads',
+    'dumps'
+)
+
+# In order of preference for "auto". msgspec comes first as orjson decodes integers past 64 bits to floats.
+BACKENDS = ("msgspec", "orjson", "json")
+
+_backend = "json"
+
+_ENCODE_ERRORS = (msgspec.EncodeError,) if msgspec is not None else ()
+
+
+def available_backends() -> list:
+    installed = {"msgspec": msgspec is not None, "orjson": orjson is not None, "json": True}
+    return [name for name in BACKENDS if installed[name]]
+
+
+def backend() -> str:
+    return _backend
+
+
+def set_backend(name: str = "auto") -> str:
+    """Pick the codec by name, or the fastest installed one for "auto". Returns the backend in use."""
+    global _backend
+    name = (name or "auto").lower()
+    available = available_backends()
+    if name == "auto":
+        _backend = available[0]
+    elif name in available:
+        _backend = name
+    else:
+        raise ValueError(f"JSON codec `{name}` is not installed. Available: {', '.join(available)}")
+    return _backend
+
+
+def loads(data):
+    """Decode JSON from `bytes` (preferred) or `str`"""
+    try:
+        if _backend == "orjson":
+            return orjson.loads(data)
+        if _backend == "msgspec":
+            return msgspec.json.decode(data)
+    except ValueError:
+        pass  # Let the stdlib have a go, and raise its usual error if the JSON really is broken
+    return json.loads(data)
+
+
+def _stdlib_dumps(obj, indent, sort_keys) -> bytes:
+    separators = None if indent else (",", ":")
+    return json.dumps(obj, ensure_ascii=False, indent=indent, sort_keys=sort_keys,
+                      separators=separators).encode("utf-8")
+
+
+def dumps(obj, indent=None, sort_keys: bool = False) -> bytes:
+    """Encode to UTF-8 JSON bytes. Compact unless `indent` is given."""
+    indent = indent or None
+    try:
+        if _backend == "orjson" and indent in (None, 2):
+            option = (orjson.OPT_INDENT_2 if indent else 0) | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+            return orjson.dumps(obj, option=option)
+        if _backend == "msgspec":
+            encoded = msgspec.json.encode(obj, order="sorted" if sort_keys else None)
+            return msgspec.json.format(encoded, indent=indent) if indent else encoded
+    except (TypeError, ValueError, *_ENCODE_ERRORS):
+        pass
+    return _stdlib_dumps(obj, indent, sort_keys)
+
+
+set_backend("auto")
@@ -0,0 +1,60 @@
+"""
+Compression for both ends of a scrape: which encodings we ask the API for, and how JSON exports are compressed on disk.
+"""
+import gzip
+
+from urllib3.util.request import ACCEPT_ENCODING
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+__all__ = (
+    'COMPRESSIONS',
+    'accept_encoding',
+    'supported_encodings',
+    'frame_compressor'
+)
+
+# File compression for JSON exports, and the extension each one adds
+COMPRESSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def supported_encodings() -> list:
+    """Content-Encodings the HTTP stack can decode here. br and zstd need `brotli` and `zstandard` installed."""
+    return [encoding.strip() for encoding in ACCEPT_ENCODING.split(",") if encoding.strip()]
+
+
+def accept_encoding(setting="auto") -> str:
+    """
+    The `Accept-Encoding` header to send. "auto" offers every encoding that can be decoded, best first.
+    A list (or comma separated string) offers only those, skipping any that can't be decoded here.
+    """
+    supported = supported_encodings()
+    preferred = [encoding for encoding in ("zstd", "br", "gzip", "deflate") if encoding in supported]
+    if not setting or setting == "auto":
+        return ", ".join(preferred)
+    if isinstance(setting, str):
+        setting = setting.split(",")
+    wanted = [encoding.strip().lower() for encoding in setting]
+    return ", ".join(encoding for encoding in wanted if encoding in supported) or "identity"
+
+
+def frame_compressor(name: str, level=None):
+    """
+    Returns a function that compresses a chunk into one self-contained gzip member or zstd frame.
+
+    Both formats allow members/frames to be concatenated, and decompress them as one stream. So a file can be
+    compressed page by page, and still be cut back to the end of any page when a scrape resumes.
+    """
+    name = name.lower()
+    if name == "gzip":
+        level = 6 if level is None else int(level)
+        return lambda chunk: gzip.compress(chunk, compresslevel=level, mtime=0)
+    if name == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd compression needs the `zstandard` package: pip install zstandard")
+        compressor = zstandard.ZstdCompressor(level=3 if level is None else int(level))
+        return compressor.compress
+    raise ValueError(f"Unknown compression `{name}`. Expected one of {', '.join(COMPRESSIONS)}")
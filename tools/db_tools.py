@@ -0,0 +1,210 @@
+"""
+The Supabase database: creating the codex table, and the DB scrape method's sink, which upserts through PostgREST or,
+with `DB_LOADER.MODE` set to COPY, loads straight into Postgres.
+"""
+import sys
+import time
+
+import postgrest
+import psycopg2
+
+from tools import program_tools
+from tools.batch_tools import dedupe_entries, plan_batches
+from tools.loader_tools import CopyLoader
+from tools.metrics_tools import Metrics
+from tools.program_tools import Info, load_config
+from tools.sink_tools import LoaderSection, Sink
+
+__all__ = (
+    'DbSink',
+    'create_table',
+    'retry_upsert'
+)
+
+
+def _schema_sql(schema: int) -> str:
+    """The SQL of `Schema[schema]` in sql/schemas.sql, or "" when there is no such schema"""
+    with open('sql/schemas.sql', 'r') as sql_file:
+        schema_sections = sql_file.read().strip().split('-- ###BREAK')
+    if not 1 <= schema < len(schema_sections):
+        return ""
+    table_create = schema_sections[schema]
+    # A schema that is only comments (a placeholder) counts as empty
+    if not any(line.strip() and not line.strip().startswith("--") for line in table_create.splitlines()):
+        return ""
+    return table_create
+
+
+def create_table(schema=None):
+    """
+    Create the codex table from `Schema[schema]` in sql/schemas.sql. Defaults to DB_SCHEMA in config.json:
+    1 is the plain guid/section/data table, 2 adds generated columns and indexes for querying.
+    """
+    if not all([Info.host, Info.user, Info.password]):
+        raise RuntimeError("Database configuration not loaded properly!")
+
+    if schema is None:
+        schema = int(load_config(program_tools.CONFIG_FILE).get("DB_SCHEMA", 1))
+
+    print(f"Attempting connection to: host={Info.host} port={Info.port} user={Info.user}")
+    try:
+        with psycopg2.connect(
+                user=Info.user,
+                password=Info.password,
+                host=Info.host,
+                port=Info.port
+        ) as connection:
+            print("Connection successful!")
+            with connection.cursor() as cursor:
+                table_create = _schema_sql(schema)
+
+                if not table_create:
+                    print(f"Error: SQL Query for Schema[{schema}] is empty!")
+                    return False
+
+                cursor.execute(table_create)
+                connection.commit()
+                print(f"Table Successfully Created with Schema[{schema}]!")
+                return True
+
+    except psycopg2.Error as e:
+        print(f"Database error: {e}")
+        return False
+
+
+# PostgREST errors that a smaller batch can get past. Halving the batch either gets it under the size or time limit,
+# or narrows the failure down to the one entry that causes it.
+SPLIT_ERRORS = {"57014", "520", "23505", "21000", "23502"}
+
+
+def _upsert_once(s_base, entries, section, page, log, max_retries=5):
+    """Upsert one batch. Returns None on success, otherwise the error code that stopped it."""
+    retry_count = 0
+    backoff = 2
+
+    while retry_count < max_retries:
+        try:
+            res = s_base.table("codex").upsert(entries).execute()
+
+            if res.data:
+
+                log(f"Created or Updated | {len(res.data)} "
+                    f"total entries for \033[0;32m`{section}`\033[0m page {page}.")
+            else:
+                log(f"No new data inserted for `{section}` on page {page}. Data may already exist.")
+
+            return None
+
+        except postgrest.exceptions.APIError as e:
+            error_code = str(getattr(e, "code", "N/A"))
+            if error_code == "57014":  # Statement timeout
+                retry_count += 1
+                if retry_count >= max_retries:
+                    return error_code
+                Metrics.inc("codex_write_retries_total", section=section)
+                log(f"\033[0;33mError 57014: POST to database timed out on page {page} of section `{section}`. \033[0m"
+                    f"Retrying in {backoff} seconds...")
+                time.sleep(backoff)
+                backoff *= 2
+            elif error_code == "23505":  # Duplicate key error
+                log(f"\033[0;33mError 23505: Duplicate GUID detected in `{section}` on page {page}.\033[0m")
+                return error_code
+            elif error_code == "520":  # JSON could not be generated
+                log(f"\033[0;33mError 520: JSON object could not be generated for `{section}` on page {page}. "
+                    f"Object is too large...\033[0m")
+                return error_code
+            elif error_code == "21000":  # ON CONFLICT DO UPDATE affecting row twice
+                log(f"\033[0;33mError 21000: ON CONFLICT DO UPDATE command cannot affect row a second time.\033[0m")
+                return error_code
+            elif error_code == "23502":  # Missing GUID in entry
+                log(f"\033[0;33mError 23502: Missing GUID in entry.\033[0m")
+                return error_code
+            else:
+                log(f"\033[0;33mUnexpected API error while upsert section `{section}` on page {page}:\033[0m\n{e}")
+                prompt = getattr(log, "prompt", input)
+                cont = prompt(f"\nPlease report: {e.code} as message: {e.hint}. "
+                              f"Type 'exit' to quit, or press ENTER to continue.\n > ")
+                if not cont.lower() == "exit":
+                    return error_code
+                sys.exit(f"\033[0;33mDB has been force closed with errors.\033[0m")
+
+    return "max_retries"
+
+
+def _upsert_split(s_base, entries, section, page, log, failed=None):
+    """
+    Upsert `entries`, halving the batch on errors a smaller batch can get past, until only the entries that fail on
+    their own are left. Those are skipped, and handed to `failed(error_code, entries)`. Returns True if every entry
+    made it in.
+    """
+    # A timeout on a big batch is better answered by splitting it than by sending it again
+    error_code = _upsert_once(s_base, entries, section, page, log, max_retries=5 if len(entries) == 1 else 1)
+    if error_code is None:
+        return True
+
+    if error_code in SPLIT_ERRORS and len(entries) > 1:
+        middle = len(entries) // 2
+        log(f"Splitting {len(entries)} entries of `{section}` page {page} into batches of "
+            f"{middle} and {len(entries) - middle}...")
+        first = _upsert_split(s_base, entries[:middle], section, page, log, failed)
+        second = _upsert_split(s_base, entries[middle:], section, page, log, failed)
+        return first and second
+
+    Metrics.inc("codex_write_failures_total", len(entries), section=section)
+    if len(entries) == 1:
+        log(f"\033[0;33mSkipping entry `{entries[0].get('guid')}` of `{section}` page {page} "
+            f"after error {error_code}.\033[0m")
+    elif error_code == "max_retries":
+        log(f"Max retries reached for page {page} of section `{section}`. Skipping.")
+    if failed is not None:
+        failed(error_code, entries)
+    return False
+
+
+def retry_upsert(entries, section, page, log=print, max_rows=500, max_bytes=2_000_000, failed=None):
+    """
+    Upsert a page through PostgREST. Entries without a guid and repeated guids are dropped first, then the page is
+    sent in batches of at most `max_rows` entries and about `max_bytes` of JSON. A batch that fails is split in half
+    until the failing entries are found, so one bad entry no longer costs the whole page. The entries that still fail
+    go to `failed(error_code, entries)`.
+    """
+    s_base = program_tools.get_supabase_client()
+
+    entries, dropped = dedupe_entries(entries)
+    if dropped:
+        log(f"\033[0;33mDropped {dropped} entries of `{section}` page {page} with a missing or repeated GUID.\033[0m")
+
+    results = [_upsert_split(s_base, batch, section, page, log, failed)
+               for batch in plan_batches(entries, max_rows, max_bytes)]
+    return all(results)
+
+
+class DbSink(Sink):
+    """
+    The DB scrape method. Every page is written as soon as it arrives, through PostgREST by default, or with the COPY
+    loader when `DB_LOADER.MODE` is COPY. Pages can come in any order, so the work queue can use it too.
+    """
+    method = "DB"
+    ordered = False
+
+    def __init__(self, config: dict, output_dir: str = "data"):
+        super().__init__(config, output_dir)
+        batch_config = config.get("DB_LOADER", {})
+        self.loader = None
+        if batch_config.get("MODE", "REST").upper() == "COPY":
+            self.loader = CopyLoader(program_tools.get_db_pool(config), table=batch_config.get("TABLE", "codex"))
+        self.batch_limits = {
+            "max_rows": int(batch_config.get("BATCH_ROWS", 500)),
+            "max_bytes": int(batch_config.get("BATCH_BYTES", 2_000_000))
+        }
+        self.destination = "the database"
+
+    def load(self, entries, section, page, log=print, failed=None) -> bool:
+        # Insert data into Supabase. This will handle known error codes. Open a ticket if you find another code
+        # that should be handled
+        if self.loader is not None:
+            return self.loader.load(entries, section, page, log, failed)
+        return retry_upsert(entries, section, page, log, failed=failed, **self.batch_limits)
+
+    def open(self, section, log, progress=None, delta=False) -> LoaderSection:
+        return LoaderSection(self, section, log, self.dead_letters)
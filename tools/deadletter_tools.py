@@ -0,0 +1,241 @@
+"""
+Dead letters: the pages and rows a run could not fetch or write, kept with their error so they can be retried on their
+own, instead of with another full scrape.
+
+    python -m tools.deadletter_tools status
+    python -m tools.deadletter_tools replay                  # retry what is due, once
+    python -m tools.deadletter_tools replay --wait           # keep retrying until nothing is left to retry
+    python -m tools.deadletter_tools replay --failed         # also retry letters that have used up their attempts
+    python -m tools.deadletter_tools clear --section items
+"""
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from tools import codec_tools
+from tools.state_tools import STATE_DIR
+
+__all__ = (
+    'DEAD_LETTERS_PATH',
+    'DeadLetters'
+)
+
+DEAD_LETTERS_PATH = os.path.join(STATE_DIR, "dead-letters.sqlite")
+
+_STATES = ("pending", "failed")
+
+# The guid of a page letter, which stands for the whole page
+_PAGE = ""
+
+
+class DeadLetters:
+    """
+    A scrape method's dead letters, in SQLite. A page that could not be fetched is one letter with no payload, to be
+    fetched again. A row that could not be written is a letter of its own, holding the row as it was to be written.
+    Either way a letter keeps the error code that stopped it.
+
+    Letters are keyed by page and guid, so failing again only updates a letter. Once a page is written, its letters
+    are resolved, whether that was by a replay or by a later scrape. A replay that fails puts the page's letters back
+    with a doubling delay, and after `max_attempts` they are marked failed and left for a person to look at.
+    """
+
+    def __init__(self, path: str = DEAD_LETTERS_PATH, method: str = "DB", max_attempts: int = 5,
+                 retry_delay: float = 30):
+        self.path = path
+        self.method = str(method).upper()
+        self.max_attempts = max(1, int(max_attempts))
+        self.retry_delay = float(retry_delay)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS letters ("
+                "method TEXT NOT NULL, section TEXT NOT NULL, page INTEGER NOT NULL, guid TEXT NOT NULL, "
+                "error TEXT, message TEXT, payload BLOB, state TEXT NOT NULL DEFAULT 'pending', "
+                "attempts INTEGER NOT NULL DEFAULT 0, retry_at REAL NOT NULL DEFAULT 0, created_at REAL NOT NULL, "
+                "PRIMARY KEY (method, section, page, guid)) WITHOUT ROWID"
+            )
+
+    @classmethod
+    def from_config(cls, config: dict, method: str) -> Optional["DeadLetters"]:
+        """`method`'s dead letters, as set under DEAD_LETTERS in config.json. None when they are turned off."""
+        letters_config = config.get("DEAD_LETTERS", {})
+        if not letters_config.get("ENABLED", True):
+            return None
+        return cls(letters_config.get("PATH") or DEAD_LETTERS_PATH, method,
+                   max_attempts=letters_config.get("MAX_ATTEMPTS", 5),
+                   retry_delay=letters_config.get("RETRY_DELAY", 30))
+
+    def _add(self, rows: list):
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                # A letter that fails again keeps its attempts, so a replay's backoff carries on where it was
+                self._connection.executemany(
+                    "INSERT INTO letters (method, section, page, guid, error, message, payload, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (method, section, page, guid) DO UPDATE SET "
+                    "error = excluded.error, message = excluded.message, payload = excluded.payload", rows)
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def add_page(self, section: str, page: int, error: str, message: str = ""):
+        """`page` of `section` could not be fetched"""
+        self._add([(self.method, section, int(page), _PAGE, str(error), str(message)[:1000], None, time.time())])
+
+    def add_rows(self, section: str, page: int, error: str, entries: list, message: str = ""):
+        """`entries` of `page` could not be written. Entries without a guid are left out, as no sink writes them."""
+        now = time.time()
+        rows = [(self.method, section, int(page), str(entry["guid"]), str(error), str(message)[:1000],
+                 codec_tools.dumps(entry), now) for entry in entries if entry.get("guid")]
+        if rows:
+            self._add(rows)
+
+    def resolve(self, section: str, page: int):
+        """
+        `page` of `section` is written, so none of its letters are needed any more. Always asks the table, as another
+        process may have dead-lettered the page since this one started. The delete is a primary key lookup.
+        """
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM letters WHERE method = ? AND section = ? AND page = ?", (self.method, section, int(page)))
+
+    def due(self, section: str = None, include_failed: bool = False) -> list:
+        """
+        The pages to replay now, as `(section, page, rows)`. `rows` are the rows to write again, or None when the
+        page has to be fetched again. With `include_failed`, letters that used up their attempts are due too.
+        """
+        states = _STATES if include_failed else ("pending",)
+        sql = (f"SELECT section, page, guid, payload FROM letters WHERE method = ? AND retry_at <= ? "
+               f"AND state IN ({', '.join('?' * len(states))})")
+        params = [self.method, time.time(), *states]
+        if section is not None:
+            sql += " AND section = ?"
+            params.append(section)
+        with self._lock:
+            letters = self._connection.execute(f"{sql} ORDER BY section, page", params).fetchall()
+
+        pages = {}
+        for section_name, page, guid, payload in letters:
+            key = (section_name, page)
+            if guid == _PAGE:
+                # Fetching the page again writes all of its rows as well
+                pages[key] = None
+            elif key not in pages:
+                pages[key] = [codec_tools.loads(payload)]
+            elif pages[key] is not None:
+                pages[key].append(codec_tools.loads(payload))
+        return [(section_name, page, rows) for (section_name, page), rows in pages.items()]
+
+    def retry_later(self, section: str, page: int, error: str = None) -> bool:
+        """
+        A replay of `page` failed. Its letters are retried after a doubling delay, and keep their error unless a new
+        one is given. Returns True once they have used up their attempts.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT MAX(attempts) FROM letters WHERE method = ? AND section = ? AND page = ?",
+                (self.method, section, page)).fetchone()
+            attempts = (row[0] or 0) + 1
+            state = "failed" if attempts >= self.max_attempts else "pending"
+            delay = self.retry_delay * 2 ** (attempts - 1)
+            error = None if error is None else str(error)[:1000]
+            self._connection.execute(
+                "UPDATE letters SET state = ?, attempts = ?, retry_at = ?, error = COALESCE(?, error) "
+                "WHERE method = ? AND section = ? AND page = ?",
+                (state, attempts, time.time() + delay, error, self.method, section, page))
+            return state == "failed"
+
+    def next_retry(self, section: str = None) -> Optional[float]:
+        """When the next pending letter is due, or None when there are none"""
+        sql = "SELECT MIN(retry_at) FROM letters WHERE method = ? AND state = 'pending'"
+        params = [self.method]
+        if section is not None:
+            sql += " AND section = ?"
+            params.append(section)
+        with self._lock:
+            return self._connection.execute(sql, params).fetchone()[0]
+
+    def counts(self) -> dict:
+        """`{section: {state: letters}}`"""
+        counts = {}
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT section, state, COUNT(*) FROM letters WHERE method = ? GROUP BY section, state "
+                "ORDER BY section", (self.method,)).fetchall()
+        for section, state, count in rows:
+            counts.setdefault(section, dict.fromkeys(_STATES, 0))[state] = count
+        return counts
+
+    def letters(self, limit: int = 20) -> list:
+        """`(section, page, guid, error, attempts, state)`, oldest first. `guid` is "" for a page not fetched."""
+        with self._lock:
+            return self._connection.execute(
+                "SELECT section, page, guid, error, attempts, state FROM letters WHERE method = ? "
+                "ORDER BY created_at, section, page LIMIT ?", (self.method, int(limit))).fetchall()
+
+    def clear(self, section: str = None):
+        sql = "DELETE FROM letters WHERE method = ?"
+        params = [self.method]
+        if section is not None:
+            sql += " AND section = ?"
+            params.append(section)
+        with self._lock:
+            self._connection.execute(sql, params)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Look at and replay the pages and rows a scrape could not save")
+    parser.add_argument("--method", help="scrape method the letters were written by (default SCRAPE_METHOD)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="letters per section and state, and the oldest of them")
+    replay = commands.add_parser("replay", help="fetch and write the dead-lettered pages and rows again")
+    replay.add_argument("--section", help="only replay this section")
+    replay.add_argument("--failed", action="store_true", help="also replay letters that used up their attempts")
+    replay.add_argument("--wait", action="store_true", help="wait out each backoff until nothing is left to retry")
+    clear = commands.add_parser("clear", help="drop letters without replaying them")
+    clear.add_argument("--section", help="only drop this section's letters")
+    args = parser.parse_args()
+
+    # Imported here, as table_tools builds on this module
+    from tools import program_tools, table_tools
+
+    config = program_tools.load_config(program_tools.CONFIG_FILE)
+    method = (args.method or config.get("SCRAPE_METHOD", "DB")).upper()
+    if args.command == "replay":
+        try:
+            table_tools.replay_dead_letters(config, method, args.section, args.failed, args.wait)
+        except ValueError as e:
+            raise SystemExit(f"\033[0;31m{e}\033[0m")
+        return
+
+    dead_letters = DeadLetters.from_config(config, method)
+    if dead_letters is None:
+        raise SystemExit("Dead letters are turned off. Set DEAD_LETTERS.ENABLED in config.json.")
+    try:
+        if args.command == "clear":
+            dead_letters.clear(args.section)
+            print(f"Cleared {method} dead letters{f' of `{args.section}`' if args.section else ''}.")
+            return
+        for section, states in dead_letters.counts().items():
+            print(f"{section:<20}" + "".join(f"{state} {count:<8}" for state, count in states.items()))
+        for section, page, guid, error, attempts, state in dead_letters.letters():
+            what = f"entry `{guid}` of page {page}" if guid else f"page {page}"
+            colour = "\033[0;31m" if state == "failed" else "\033[0;33m"
+            print(f"{colour}{state.capitalize()}\033[0m {section} {what}: {error} ({attempts} replays)")
+    finally:
+        dead_letters.close()
+
+
+if __name__ == "__main__":
+    main()
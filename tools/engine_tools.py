@@ -0,0 +1,430 @@
+import multiprocessing
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_EXCEPTION, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+from tools.metrics_tools import Metrics
+from tools.program_tools import COLOR_CODES
+
+__all__ = (
+    'Engine',
+    'SectionLog',
+    'ScrapeStopped',
+    'StageTimer'
+)
+
+# One lock for the whole console, so lines from different sections never interleave mid-line.
+_print_lock = threading.Lock()
+
+
+class ScrapeStopped(RuntimeError):
+    """Raised inside section workers once the engine has been asked to stop"""
+
+
+class SectionLog:
+    """Console output for a single section. Every line is tagged with the section name."""
+
+    def __init__(self, section: str):
+        self.section = section
+
+    def __call__(self, message: str):
+        with _print_lock:
+            print(f"{COLOR_CODES['CYAN']}[{self.section}]{COLOR_CODES['RESET']} {message}")
+
+    def prompt(self, message: str) -> str:
+        # Hold the console while waiting on the user so other sections don't scribble over the prompt.
+        with _print_lock:
+            return input(message)
+
+
+class StageTimer:
+    """Wall time spent in each pipeline stage, per page and in total."""
+    STAGES = ("fetch", "transform", "write")
+
+    def __init__(self, section: str):
+        self.section = section
+        self.pages = {}
+        self.totals = dict.fromkeys(self.STAGES, 0.0)
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, page: int, stage: str, seconds: float):
+        with self._lock:
+            self.pages.setdefault(page, {})[stage] = seconds
+            self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+        Metrics.observe("codex_stage_seconds", seconds, section=self.section, stage=stage)
+
+    def timed(self, stage: str, fn):
+        """Wrap `fn(section, page, ...)` so each call is recorded against `page`"""
+        def wrapper(section, page, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(section, page, *args, **kwargs)
+            finally:
+                self.record(page, stage, time.perf_counter() - start)
+        return wrapper
+
+    def page_line(self, page: int) -> str:
+        with self._lock:
+            times = self.pages.pop(page, {})
+        stages = " | ".join(f"{stage} {times.get(stage, 0.0):.2f}s" for stage in self.STAGES)
+        return f"Page \033[0;32m{page}\033[0m | {stages}"
+
+    def summary(self, page_count: int) -> str:
+        stages = " | ".join(f"{stage} {self.totals.get(stage, 0.0):.2f}s" for stage in self.STAGES)
+        return f"{page_count} pages in {time.perf_counter() - self.started:.2f}s | {stages}"
+
+
+class _Failure:
+    """Carries an exception from one pipeline stage to the next"""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+_DONE = object()
+
+
+@dataclass
+class Engine:
+    """
+    Runs several sections at once on a thread pool.
+
+    max_sections: How many sections are scraped at the same time.
+    max_requests: Global cap on in-flight HTTP requests, shared by every section.
+    per_section:  How many pages of a single section may be in flight at once.
+    queue_size:   How many pages may wait between two pipeline stages before the earlier stage blocks.
+    transform_processes: Worker processes shared by every section's transform stage. 0 transforms in a thread.
+    fan_out:      When set, each section's last page is found first, and up to this many of its pages are fetched at
+                  once. 0 fetches `per_section` pages ahead until the empty page.
+    """
+    max_sections: int = 3
+    max_requests: int = 6
+    per_section: int = 2
+    queue_size: int = 4
+    transform_processes: int = 0
+    fan_out: int = 0
+    stats: dict = field(init=False, repr=False)
+    _gate: threading.BoundedSemaphore = field(init=False, repr=False)
+    _stop: threading.Event = field(init=False, repr=False)
+    _processes: ProcessPoolExecutor = field(init=False, repr=False, default=None)
+
+    def __post_init__(self):
+        self.max_sections = max(1, int(self.max_sections))
+        self.max_requests = max(1, int(self.max_requests))
+        self.per_section = max(1, int(self.per_section))
+        self.queue_size = max(1, int(self.queue_size))
+        self.transform_processes = max(0, int(self.transform_processes))
+        self.fan_out = max(0, int(self.fan_out))
+        self.stats = {}
+        self._gate = threading.BoundedSemaphore(self.max_requests)
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_config(cls, config: dict) -> "Engine":
+        concurrency = config.get("CONCURRENCY", {})
+        return cls(
+            max_sections=concurrency.get("SECTIONS", cls.max_sections),
+            max_requests=concurrency.get("REQUESTS", cls.max_requests),
+            per_section=concurrency.get("PER_SECTION", cls.per_section),
+            queue_size=concurrency.get("QUEUE_SIZE", cls.queue_size),
+            transform_processes=concurrency.get("TRANSFORM_PROCESSES", cls.transform_processes),
+            fan_out=concurrency.get("FAN_OUT", cls.fan_out)
+        )
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop.is_set()
+
+    def stop(self):
+        self._stop.set()
+
+    @contextmanager
+    def slot(self):
+        """
+        Hold one of the global request slots. Only take it around the HTTP request itself: a page waiting out a
+        backoff must not keep a slot other sections could use.
+        """
+        with self._gate:
+            if self.stopped:
+                raise ScrapeStopped()
+            yield
+
+    def request(self, fn, *args, **kwargs):
+        """Call `fn` unless the engine has stopped. `fn` takes a `slot()` for each HTTP request it sends."""
+        if self.stopped:
+            raise ScrapeStopped()
+        return fn(*args, **kwargs)
+
+    def run_sections(self, sections: list, worker) -> dict:
+        """
+        Run `worker(section)` for every section, at most `max_sections` at a time.
+        Results are returned in the same order as `sections`. The first error raised by a worker
+        (including SystemExit) stops the other sections, and is re-raised here once they have let go.
+        The transform processes, if any, live for the length of the call.
+        """
+        if not sections:
+            return {}
+
+        if self.transform_processes:
+            # Never fork: the scraper is threaded by now, and a forked child could inherit a lock held mid-update.
+            # The forkserver would preload `__main__` by default. The workers only need tools.transform_tools.
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            if context.get_start_method() == "forkserver":
+                context.set_forkserver_preload([])
+            self._processes = ProcessPoolExecutor(max_workers=self.transform_processes, mp_context=context)
+        try:
+            with ThreadPoolExecutor(max_workers=min(self.max_sections, len(sections)),
+                                    thread_name_prefix="section") as pool:
+                futures = {section: pool.submit(worker, section) for section in sections}
+                try:
+                    # Don't wait on the sections in order, or a failure would only be seen once those before it end
+                    done, _ = wait(futures.values(), return_when=FIRST_EXCEPTION)
+                    for future in futures.values():
+                        if future in done and future.exception() is not None:
+                            future.result()
+                    return {section: future.result() for section, future in futures.items()}
+                except BaseException:
+                    # Ctrl+C, an "exit" at a prompt, or a section that failed. Let running sections finish the page
+                    # they are on, and cancel everything else.
+                    self.stop()
+                    for future in futures.values():
+                        future.cancel()
+                    raise
+        finally:
+            if self._processes is not None:
+                self._processes.shutdown(cancel_futures=True)
+                self._processes = None
+
+    def discover_last_page(self, section: str, fetch_page, start: int = 1):
+        """
+        Find the last page of `section` from `start` on, as the API has no page count. Pages `start`, `start + 1`,
+        `start + 2`, `start + 4`, ... are probed until one comes back empty, then the gap between the last full page
+        and that one is binary searched. About 2 * log2(pages) requests, one at a time.
+
+        Returns `(last_page, probed)`: `last_page` is `start - 1` when there is nothing left, and `probed` maps every
+        page that had data to it, so those pages needn't be fetched again.
+        """
+        probed = {}
+
+        def has_data(page) -> bool:
+            data = self.request(fetch_page, section, page)
+            if data:
+                probed[page] = data
+            return bool(data)
+
+        full, empty, step = start - 1, None, 0
+        while empty is None:
+            page = start + step
+            if has_data(page):
+                full = page
+                step = step * 2 or 1
+            else:
+                empty = page
+        while empty - full > 1:
+            middle = (full + empty) // 2
+            if has_data(middle):
+                full = middle
+            else:
+                empty = middle
+        return full, {page: data for page, data in probed.items() if page <= full}
+
+    def iter_pages(self, section: str, fetch_page, start: int = 1, log=None):
+        """
+        Yield `(page, data)` for `section` in page order, starting from `start`.
+
+        Up to `per_section` pages are fetched ahead of the one being consumed. `fetch_page(section, page)`
+        must return the page's `data` list; the first empty page ends the section, as the API
+        has no page count.
+
+        With `fan_out`, the last page is found first, then up to `fan_out` pages are fetched at once up to it, still
+        under the shared request cap and rate limit. The empty page still has the final say: if there turn out to be
+        more pages than were found, the rest are fetched `per_section` at a time.
+        """
+        last_page, probed = None, {}
+        if self.fan_out:
+            last_page, probed = self.discover_last_page(section, fetch_page, start)
+            if log is not None:
+                log(f"Found {last_page - start + 1} pages to fetch, {self.fan_out} at a time.")
+        workers = max(self.per_section, self.fan_out)
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{section}-fetch") as pool:
+            pending = deque()
+            next_page = start
+            try:
+                while True:
+                    fanning_out = last_page is not None and next_page <= last_page + 1
+                    while (len(pending) < (self.fan_out if fanning_out else self.per_section) and not self.stopped
+                           and (last_page is None or next_page <= last_page + 1)):
+                        if next_page in probed:
+                            pending.append((next_page, probed.pop(next_page)))
+                        else:
+                            pending.append((next_page, pool.submit(self.request, fetch_page, section, next_page)))
+                        next_page += 1
+
+                    if not pending:
+                        raise ScrapeStopped()
+
+                    page, result = pending.popleft()
+                    data = result.result() if isinstance(result, Future) else result
+                    if not data:
+                        return
+                    if last_page is not None and page > last_page:
+                        # Pages were added since discovery. Go back to reading until the empty page.
+                        last_page = None
+                    yield page, data
+            finally:
+                for _, result in pending:
+                    if isinstance(result, Future):
+                        result.cancel()
+
+    def pipeline(self, section: str, fetch_page, transform, write, log, start: int = 1, prepare=None) -> int:
+        """
+        Scrape `section` through three stages joined by bounded queues:
+
+            fetch_page(section, page) -> data      (fetcher thread, via iter_pages)
+            transform(page, data) -> rows          (transformer thread)
+            write(page, rows)                      (calling thread)
+
+        While page N is being written, the pages after it are already being fetched and transformed.
+        Once a queue holds `queue_size` pages the stage feeding it waits, so memory stays flat when the
+        writer is the slow side. Any error is re-raised here, and stops the other stages.
+
+        With `prepare`, the transform stage becomes `transform(page, prepare(section, data))`. `prepare` runs in the
+        transform processes when there are any, with up to `transform_processes` of the section's pages in flight at
+        once, and pages still come out in order. It and its arguments must be picklable, so keep them to a
+        module-level function and bytes.
+
+        Returns the number of pages written. Page/row counts and stage timings are also kept in `stats[section]`.
+        """
+        timer = StageTimer(section)
+        fetched = queue.Queue(maxsize=self.queue_size)
+        transformed = queue.Queue(maxsize=self.queue_size)
+        halt = threading.Event()
+
+        def put(q, item) -> bool:
+            while not halt.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def get(q):
+            while not halt.is_set():
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            return _DONE
+
+        def fetcher():
+            pages = self.iter_pages(section, timer.timed("fetch", fetch_page), start, log)
+            try:
+                for item in pages:
+                    if not put(fetched, item):
+                        return
+                put(fetched, _DONE)
+            except BaseException as e:
+                put(fetched, _Failure(e))
+            finally:
+                pages.close()
+
+        def transformer():
+            while True:
+                item = get(fetched)
+                if item is _DONE or isinstance(item, _Failure):
+                    put(transformed, item)
+                    return
+                page, data = item
+                started = time.perf_counter()
+                try:
+                    rows = transform(page, data if prepare is None else prepare(section, data))
+                except BaseException as e:
+                    put(transformed, _Failure(e))
+                    return
+                timer.record(page, "transform", time.perf_counter() - started)
+                if not put(transformed, (page, rows)):
+                    return
+
+        def pooled_transformer():
+            pending = deque()
+            last = None
+            try:
+                while not halt.is_set():
+                    # Hand on the oldest page once it is ready, or when there's nothing more to submit
+                    if pending and (last is not None or len(pending) >= self.transform_processes
+                                    or pending[0][1].done()):
+                        page, future = pending.popleft()
+                        started = time.perf_counter()
+                        try:
+                            rows = transform(page, future.result())
+                        except BaseException as e:
+                            put(transformed, _Failure(e))
+                            return
+                        timer.record(page, "transform", time.perf_counter() - started)
+                        if not put(transformed, (page, rows)):
+                            return
+                        continue
+                    if last is not None:
+                        put(transformed, last)
+                        return
+                    try:
+                        item = fetched.get(timeout=0.05)
+                    except queue.Empty:
+                        continue
+                    if item is _DONE or isinstance(item, _Failure):
+                        last = item
+                        continue
+                    page, data = item
+                    pending.append((page, self._processes.submit(prepare, section, data)))
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+        pooled = prepare is not None and self._processes is not None
+        threads = [
+            threading.Thread(target=fetcher, name=f"{section}-fetcher", daemon=True),
+            threading.Thread(target=pooled_transformer if pooled else transformer, name=f"{section}-transformer",
+                             daemon=True)
+        ]
+        for thread in threads:
+            thread.start()
+
+        written = 0
+        rows_written = 0
+        try:
+            while True:
+                item = get(transformed)
+                if item is _DONE:
+                    break
+                if isinstance(item, _Failure):
+                    raise item.error
+                page, rows = item
+                started = time.perf_counter()
+                write(page, rows)
+                timer.record(page, "write", time.perf_counter() - started)
+                written += 1
+                rows_written += len(rows) if rows is not None else 0
+                Metrics.inc("codex_pages_total", section=section)
+                Metrics.inc("codex_rows_total", len(rows) if rows is not None else 0, section=section)
+                log(timer.page_line(page))
+        finally:
+            halt.set()
+            for thread in threads:
+                thread.join()
+            self.stats[section] = {
+                "pages": written,
+                "rows": rows_written,
+                "seconds": time.perf_counter() - timer.started,
+                "stages": dict(timer.totals)
+            }
+            log(f"Stage timing | {timer.summary(written)}")
+
+        return written
@@ -0,0 +1,182 @@
+import os
+
+from tools import codec_tools
+from tools.compression_tools import COMPRESSIONS, frame_compressor
+from tools.sink_tools import SectionSink, Sink
+from tools.transform_tools import EncodedRows
+
+__all__ = (
+    'JsonSink',
+    'JsonStreamWriter',
+)
+
+
+def _compression(setting):
+    """COMPRESSION from config.json, with "", "none" and null all meaning uncompressed"""
+    if not setting or str(setting).lower() == "none":
+        return None
+    return str(setting).lower()
+
+
+class JsonStreamWriter:
+    """
+    Writes one section's entries to disk page by page, so memory is bounded by a page rather than the section.
+
+    Entries go to `<path>.partial` and the file is renamed to `path` by `finish()`, so a reader never sees half a file.
+    FORMAT "JSON" builds a JSON array as it goes, "NDJSON" writes one entry per line. `indent` of 0/None writes
+    compact JSON. `write()` returns the partial file's size, which is enough to pick the file back up with `offset`
+    (and `count`, the entries already in it) after a crash.
+
+    With `compression` ("gzip" or "zstd"), each `write()` is compressed as its own gzip member or zstd frame as it is
+    written. The file is still a single valid `.gz`/`.zst`, and the offsets still land on page boundaries.
+    """
+    FORMATS = {"JSON": ".json", "NDJSON": ".ndjson"}
+
+    def __init__(self, path: str, fmt: str = "JSON", indent=2, offset: int = 0, count: int = 0,
+                 compression: str = None, level: int = None):
+        fmt = fmt.upper()
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Unknown JSON export format `{fmt}`. Expected one of {', '.join(self.FORMATS)}")
+
+        self.path = path
+        self.partial_path = f"{path}.partial"
+        self.format = fmt
+        self.indent = indent or None
+        self.count = count
+        self._compress = frame_compressor(compression, level) if _compression(compression) else None
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(self.partial_path, "ab")
+        self._file.truncate(offset)
+        self._file.seek(offset)
+        # Held back and sent with the next chunk, so a compressed file doesn't start with a frame of its own
+        self._pending = b"[" if offset == 0 and self.format == "JSON" else b""
+
+    @classmethod
+    def section_path(cls, output_dir: str, section: str, export_config: dict, delta: bool = False) -> str:
+        suffix = cls.FORMATS.get(export_config.get("FORMAT", "JSON").upper(), ".json")
+        compression = _compression(export_config.get("COMPRESSION"))
+        if compression:
+            suffix += COMPRESSIONS.get(compression, "")
+        return os.path.join(output_dir, f"{section}.delta{suffix}" if delta else f"{section}{suffix}")
+
+    @classmethod
+    def for_section(cls, output_dir: str, section: str, export_config: dict, delta: bool = False,
+                    offset: int = 0, count: int = 0) -> "JsonStreamWriter":
+        path = cls.section_path(output_dir, section, export_config, delta)
+        return cls(path, export_config.get("FORMAT", "JSON"), export_config.get("INDENT", 2), offset, count,
+                   _compression(export_config.get("COMPRESSION")), export_config.get("LEVEL"))
+
+    def _encode(self, entry) -> bytes:
+        """One entry as it goes in the file. A compact layout takes an entry that is already encoded as it is."""
+        if self.format == "NDJSON":
+            return (entry if isinstance(entry, bytes) else codec_tools.dumps(entry)) + b"\n"
+
+        separator = b"," if self.count else b""
+        if self.indent is None:
+            return separator + b"\n" + (entry if isinstance(entry, bytes) else codec_tools.dumps(entry))
+
+        # Same layout json.dump(entries, indent=n) would give, one entry at a time
+        pad = b" " * self.indent
+        encoded = codec_tools.dumps(entry, indent=self.indent).replace(b"\n", b"\n" + pad)
+        return separator + b"\n" + pad + encoded
+
+    def write(self, entries: list) -> int:
+        """Append `entries` and flush them to disk. Returns the partial file's size."""
+        if isinstance(entries, EncodedRows) and (self.format == "NDJSON" or self.indent is None):
+            entries = entries.row_bytes()
+        chunk = [self._pending]
+        for entry in entries:
+            chunk.append(self._encode(entry))
+            self.count += 1
+        self._pending = b""
+        self._write_chunk(b"".join(chunk))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def finish(self):
+        """Close off the file and move it into place"""
+        if self.format == "JSON":
+            self._pending += b"\n]" if self.count else b"]"
+        self._write_chunk(self._pending)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.partial_path, self.path)
+
+    def _write_chunk(self, chunk: bytes):
+        if chunk:
+            self._file.write(self._compress(chunk) if self._compress is not None else chunk)
+
+    def close(self):
+        """Close without finishing. The partial file stays, ready to be resumed."""
+        if not self._file.closed:
+            self._file.close()
+
+    def discard(self):
+        """Close and delete the partial file, leaving any earlier output at `path` untouched"""
+        self.close()
+        os.remove(self.partial_path)
+
+
+class _JsonSection(SectionSink):
+    def __init__(self, writer: JsonStreamWriter, section: str, log, delta: bool = False):
+        self.writer = writer
+        self.section = section
+        self.log = log
+        self.delta = delta
+        self.offset = 0
+
+    @property
+    def checkpoint(self) -> dict:
+        return {"offset": self.offset, "count": self.writer.count}
+
+    def write_batch(self, page: int, entries: list) -> list:
+        self.offset = self.writer.write(entries)
+        return [(page, True)]
+
+    def close(self, finished: bool = True) -> bool:
+        if not finished:
+            self.writer.close()
+            return False
+        saved = self.writer.count
+        if saved:
+            self.writer.finish()
+            self.log(f"\033[0;32mSaved {saved} entries to {self.writer.path}\033[0m")
+        elif self.delta:
+            # An empty delta still replaces the last one, or it would be read as this run's changes
+            self.writer.finish()
+            self.log(f"\033[0;33mNo changes for section `{self.section}`, {self.writer.path} is empty\033[0m")
+        else:
+            self.writer.discard()
+            self.log(f"\033[0;33mNo data saved for section `{self.section}`\033[0m")
+        return bool(saved)
+
+
+class JsonSink(Sink):
+    """The JSON scrape method: one JSON or NDJSON file per section, streamed page by page (see `JSON_EXPORT`)"""
+    method = "JSON"
+    tag_data = False
+
+    def __init__(self, config: dict, output_dir: str = "data"):
+        super().__init__(config, output_dir)
+        self.export_config = config.get("JSON_EXPORT", {})
+        self.destination = f"{output_dir}/"
+        os.makedirs(output_dir, exist_ok=True)
+
+    def open(self, section, log, progress=None, delta=False) -> _JsonSection:
+        # An incremental run only holds new and changed entries, so it must not replace the full snapshot.
+        partial_path = f"{JsonStreamWriter.section_path(self.output_dir, section, self.export_config, delta)}.partial"
+
+        # Entries are streamed into the output's `.partial` file page by page. Anything past the last checkpoint
+        # belongs to a page that never finished, and is cut off when the file is reopened.
+        checkpoint = {}
+        if progress is not None:
+            if progress.resumed and not os.path.exists(partial_path):
+                log(f"\033[0;33m{partial_path} is missing, starting `{section}` over.\033[0m")
+                progress.restart()
+            checkpoint = progress.checkpoint
+        writer = JsonStreamWriter.for_section(self.output_dir, section, self.export_config, delta,
+                                              offset=checkpoint.get("offset", 0), count=checkpoint.get("count", 0))
+        return _JsonSection(writer, section, log, delta)
@@ -0,0 +1,172 @@
+import io
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import errors
+
+from tools import codec_tools
+from tools.metrics_tools import Metrics
+from tools.transform_tools import EncodedRows
+
+__all__ = (
+    'CopyLoader',
+)
+
+# Transaction-scoped staging table. Temp tables skip the WAL like an UNLOGGED table, and ON COMMIT DROP keeps
+# this safe behind Supabase's transaction pooler (port 6543), where a session may not outlive its transaction.
+_STAGING_SQL = """
+CREATE TEMP TABLE codex_staging (
+    position BIGINT,
+    guid TEXT,
+    section TEXT,
+    data JSONB
+) ON COMMIT DROP
+"""
+
+# DISTINCT ON keeps the last copy of a guid in the batch, so ON CONFLICT never touches a row twice (21000),
+# and rows without a guid are dropped rather than failing the batch (23502). `position` is written by the COPY itself,
+# as a table scan makes no promise to return rows in the order they were copied.
+_MERGE_SQL = """
+INSERT INTO {table} (guid, section, data)
+SELECT DISTINCT ON (guid) guid, section, data
+FROM codex_staging
+WHERE guid IS NOT NULL
+ORDER BY guid, position DESC
+ON CONFLICT (guid) DO UPDATE SET section = EXCLUDED.section, data = EXCLUDED.data
+"""
+
+
+def _copy_field(value) -> bytes:
+    """Escape one value for COPY's text format"""
+    if value is None:
+        return b"\\N"
+    if not isinstance(value, bytes):
+        value = str(value).encode("utf-8")
+    return (value
+            .replace(b"\\", b"\\\\")
+            .replace(b"\t", b"\\t")
+            .replace(b"\n", b"\\n")
+            .replace(b"\r", b"\\r"))
+
+
+class CopyLoader:
+    """
+    Loads codex rows straight into Postgres, skipping PostgREST.
+
+    Each batch is streamed with `COPY ... FROM STDIN` into a staging table, then merged into the codex table with a
+    single `INSERT ... ON CONFLICT (guid) DO UPDATE`, all in one transaction on a pooled connection. A batch the
+    database rejects is split in half until only the entries that fail on their own are left, like the REST path.
+    """
+
+    def __init__(self, pool, table: str = "codex", max_retries: int = 3):
+        self.pool = pool
+        self.table = table
+        self.max_retries = max_retries
+
+    @contextmanager
+    def connection(self):
+        connection = self.pool.getconn()
+        try:
+            yield connection
+        except psycopg2.InterfaceError:
+            # The server went away. Don't hand a dead connection back to the pool.
+            self.pool.putconn(connection, close=True)
+            connection = None
+            raise
+        finally:
+            if connection is not None:
+                self.pool.putconn(connection)
+
+    def copy_buffer(self, entries) -> io.BytesIO:
+        buffer = io.BytesIO()
+        if isinstance(entries, EncodedRows):
+            # Already encoded in a transform process
+            rows = ((guid, entries.section, data) for guid, data in zip(entries.guids, entries.data))
+        else:
+            rows = ((entry.get("guid"), entry.get("section"), codec_tools.dumps(entry["data"])) for entry in entries)
+        for position, fields in enumerate(rows):
+            buffer.write(b"\t".join(_copy_field(field) for field in (position, *fields)) + b"\n")
+        buffer.seek(0)
+        return buffer
+
+    def merge(self, entries) -> int:
+        """Stage and merge `entries` in one transaction. Returns the number of rows created or updated."""
+        with self.connection() as connection:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(_STAGING_SQL)
+                    cursor.copy_expert("COPY codex_staging (position, guid, section, data) FROM STDIN",
+                                       self.copy_buffer(entries))
+                    cursor.execute(_MERGE_SQL.format(table=self.table))
+                    merged = cursor.rowcount
+                connection.commit()
+                return merged
+            except BaseException:
+                if not connection.closed:
+                    connection.rollback()
+                raise
+
+    def _merge_once(self, entries, section, page, log, max_retries) -> tuple:
+        """
+        Merge one batch, retrying timeouts and dropped connections with a doubling delay.
+        Returns `(merged, None)` on success, otherwise `(0, error_code)`.
+        """
+        backoff = 2
+        for attempt in range(max_retries + 1):
+            try:
+                return self.merge(entries), None
+            except (errors.QueryCanceled, psycopg2.OperationalError) as e:
+                if attempt == max_retries:
+                    # A timeout can be split past. A connection that keeps failing can't.
+                    return 0, (e.pgcode or "57014") if isinstance(e, errors.QueryCanceled) else "max_retries"
+                Metrics.inc("codex_write_retries_total", section=section)
+                log(f"\033[0;33mError {e.pgcode or 'N/A'}: COPY to database failed on page {page} of section "
+                    f"`{section}`. \033[0mRetrying in {backoff} seconds...")
+                time.sleep(backoff)
+                backoff *= 2
+            except psycopg2.Error as e:
+                log(f"\033[0;33mError {e.pgcode or 'N/A'}: COPY failed for {len(entries)} entries of `{section}` "
+                    f"on page {page}.\033[0m\n{e}")
+                return 0, e.pgcode or "N/A"
+        return 0, "max_retries"
+
+    def _load_split(self, entries, section, page, log, failed) -> bool:
+        # A timeout or a bad entry in a big batch is better answered by splitting it than by sending it again
+        merged, error_code = self._merge_once(entries, section, page, log,
+                                              self.max_retries if len(entries) == 1 else 1)
+        if error_code is None:
+            skipped = len(entries) - merged
+            log(f"Created or Updated | {merged} total entries for \033[0;32m`{section}`\033[0m page {page}."
+                + (f" {skipped} duplicate or guid-less entries skipped." if skipped else ""))
+            return True
+
+        if error_code != "max_retries" and len(entries) > 1:
+            middle = len(entries) // 2
+            log(f"Splitting {len(entries)} entries of `{section}` page {page} into batches of "
+                f"{middle} and {len(entries) - middle}...")
+            # In order, so the last copy of a guid repeated across the halves still wins
+            first = self._load_split(entries[:middle], section, page, log, failed)
+            second = self._load_split(entries[middle:], section, page, log, failed)
+            return first and second
+
+        Metrics.inc("codex_write_failures_total", len(entries), section=section)
+        if len(entries) == 1:
+            log(f"\033[0;33mSkipping entry `{entries[0].get('guid')}` of `{section}` page {page} "
+                f"after error {error_code}.\033[0m")
+        else:
+            log(f"Max retries reached for page {page} of section `{section}`. Skipping.")
+        if failed is not None:
+            failed(error_code, entries)
+        return False
+
+    def load(self, entries, section, page, log=print, failed=None) -> bool:
+        """
+        COPY `entries` in. A batch the database rejects, or that times out, is split in half until the entries that
+        fail on their own are found. Those are skipped, and handed to `failed(error_code, entries)`. Returns True if
+        every entry made it in.
+        """
+        if not entries:
+            return True
+        return self._load_split(entries if isinstance(entries, EncodedRows) else list(entries), section, page, log,
+                                failed)
@@ -0,0 +1,270 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tools.state_tools import atomic_write
+
+__all__ = (
+    'Metrics',
+    'MetricsRegistry',
+    'Exporter',
+    'PrometheusFileExporter',
+    'PrometheusHttpExporter',
+    'JsonReportExporter',
+    'start_exporters',
+    'stop_exporters'
+)
+
+# Seconds. Wide enough for a cached page at one end and a slow `npcs` page at the other.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Help text for every metric the scraper records
+HELP = {
+    "codex_http_request_seconds": "Time spent on each HTTP request to the Ashes Codex API",
+    "codex_http_responses_total": "HTTP responses from the Ashes Codex API, by status",
+    "codex_http_retries_total": "HTTP requests that were retried",
+    "codex_http_rate_limited_total": "429 responses from the Ashes Codex API",
+    "codex_http_timeouts_total": "HTTP requests that timed out",
+    "codex_http_wire_bytes_total": "Response bytes received from the API, still compressed",
+    "codex_http_body_bytes_total": "Response bytes after decompression",
+    "codex_cache_hits_total": "Pages served from the response cache without downloading them",
+    "codex_json_decode_seconds": "Time spent decoding a page of JSON",
+    "codex_stage_seconds": "Time each pipeline stage spent on a page",
+    "codex_pages_total": "Pages written",
+    "codex_rows_total": "Rows written",
+    "codex_projection_bytes_saved_total": "Bytes of JSON that field projection cut from rows before they were stored",
+    "codex_write_retries_total": "Writes retried after a database timeout or dropped connection",
+    "codex_write_failures_total": "Pages or rows that could not be written",
+}
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class MetricsRegistry:
+    """
+    Counters and latency histograms for a run, labeled by section (and status/stage where it matters).
+    Thread-safe. Exporters read it through `snapshot()` and `prometheus_text()`.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+            self.started = time.time()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = _Histogram(self.buckets)
+            self._histograms[key].observe(seconds)
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> dict:
+        """Everything recorded so far, as plain JSON-friendly data"""
+        with self._lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self._counters.items())]
+            histograms = [{"name": name, "labels": dict(labels), "count": histogram.count, "sum": histogram.sum,
+                           "mean": histogram.sum / histogram.count if histogram.count else 0.0}
+                          for (name, labels), histogram in sorted(self._histograms.items())]
+        return {
+            "started": self.started,
+            "elapsed": time.time() - self.started,
+            "counters": counters,
+            "histograms": histograms
+        }
+
+    def prometheus_text(self) -> str:
+        """Everything recorded so far, in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(h.counts), h.count, h.sum)) for key, h in self._histograms.items())
+
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        for (name, labels), (counts, count, total) in histograms:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', str(bound)),))} {bucket_count}")
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+
+# Shared by everything in a run, the same way `Info` is
+Metrics = MetricsRegistry()
+
+
+class Exporter:
+    """Publishes a MetricsRegistry somewhere. `start()` is called before a run and `stop()` after it."""
+
+    def start(self, registry: MetricsRegistry):
+        pass
+
+    def stop(self, registry: MetricsRegistry):
+        pass
+
+
+class PrometheusFileExporter(Exporter):
+    """
+    Rewrites a Prometheus text file every `interval` seconds and once more at the end, for node_exporter's textfile
+    collector or anything else that reads the format.
+    """
+
+    def __init__(self, path: str, interval: float = 10.0):
+        self.path = path
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def write(self, registry: MetricsRegistry):
+        atomic_write(self.path, registry.prometheus_text().encode("utf-8"))
+
+    def start(self, registry: MetricsRegistry):
+        def loop():
+            while not self._stopped.wait(self.interval):
+                self.write(registry)
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=loop, name="metrics-file", daemon=True)
+        self._thread.start()
+
+    def stop(self, registry: MetricsRegistry):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write(registry)
+
+
+class PrometheusHttpExporter(Exporter):
+    """Serves `/metrics` for Prometheus to scrape while a run is going"""
+
+    def __init__(self, port: int, host: str = "127.0.0.1"):
+        self.host = host
+        self.port = port
+        self._server = None
+
+    def start(self, registry: MetricsRegistry):
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = registry.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+
+    def stop(self, registry: MetricsRegistry):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class JsonReportExporter(Exporter):
+    """Writes every counter and histogram to a JSON file once the run is over"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def stop(self, registry: MetricsRegistry):
+        atomic_write(self.path, json.dumps(registry.snapshot(), indent=2).encode("utf-8"))
+
+
+def start_exporters(config: dict, registry: MetricsRegistry = Metrics) -> list:
+    """
+    Reset `registry` for a new run, and start the exporters turned on under `METRICS` in config.json. If one fails to
+    start, those already started are stopped again.
+    """
+    metrics_config = config.get("METRICS", {})
+    exporters = []
+    if metrics_config.get("PROMETHEUS_FILE"):
+        exporters.append(PrometheusFileExporter(metrics_config["PROMETHEUS_FILE"],
+                                                float(metrics_config.get("INTERVAL", 10))))
+    if metrics_config.get("PROMETHEUS_PORT"):
+        exporters.append(PrometheusHttpExporter(int(metrics_config["PROMETHEUS_PORT"])))
+    if metrics_config.get("JSON_REPORT"):
+        exporters.append(JsonReportExporter(metrics_config["JSON_REPORT"]))
+
+    registry.reset()
+    started = []
+    try:
+        for exporter in exporters:
+            exporter.start(registry)
+            started.append(exporter)
+    except BaseException:
+        stop_exporters(started, registry)
+        raise
+    return exporters
+
+
+def stop_exporters(exporters: list, registry: MetricsRegistry = Metrics):
+    for exporter in exporters:
+        exporter.stop(registry)
@@ -0,0 +1,337 @@
+"""
+Parquet export. Each section becomes a Hive-partitioned dataset, `parquet/section={section}/part-00000.parquet`, ...,
+with typed columns for the fields worth filtering on and the whole entity kept alongside as JSON.
+"""
+import os
+import shutil
+
+from tools import codec_tools
+from tools.sink_tools import SectionSink, Sink
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+__all__ = (
+    'SECTION_COLUMNS',
+    'ParquetSectionWriter',
+    'ParquetSink',
+    'section_schema'
+)
+
+# Typed columns per section, on top of guid/name/typeId and `data`. Kinds:
+#   string/int64/float64/bool - the value as that type, null when it is missing or the wrong type
+#   ref    - a {guid, typeId, name} reference, as a struct
+#   vector - an {x, y, z} location, as a struct
+#   json   - any nested value, encoded as a JSON string
+SECTION_COLUMNS = {
+    "items": {
+        "itemName": "string", "description": "string", "level": "int64", "grade": "string", "subType": "string",
+        "rarityMin": "string", "rarityMax": "string", "defaultQuality": "int64", "maxStackSize": "int64",
+        "inventoryFilterType": "string", "isPlayerCommodity": "bool", "canEquip": "bool", "tradeable": "bool",
+        "vendorable": "bool", "displayIcon": "string", "gameplayTags": "json", "statsIds": "json"
+    },
+    "abilities": {
+        "abilityName": "string", "abilityDescription": "string", "skillTreeName": "string",
+        "weaponRequirement": "string", "abilityIcon": "string", "validDistance": "int64",
+        "areaTargetRadius": "int64", "areaTargetRange": "int64", "cooldown": "json", "abilityTags": "json"
+    },
+    "status-effects": {
+        "effectName": "string", "effectDescription": "string", "effectCategory": "string",
+        "effectStackType": "string", "bDispellable": "bool", "globalStackLimit": "int64", "tickTimer": "int64",
+        "effectDuration": "json", "effectTags": "json"
+    },
+    "npcs": {
+        "_characterName": "string", "_npcType": "string", "_characterType": "string", "_level": "int64",
+        "factionId": "int64", "aggroRadius": "int64", "leashRadius": "int64", "_vendorId": "string",
+        "_gameplayTags": "json", "_tags": "json"
+    },
+    "mobs": {
+        "_displayName": "string", "_slug": "string", "_levelRange": "string"
+    },
+    "hunting-creatures": {
+        "_displayName": "string", "_slug": "string", "_levelRange": "string", "_certificationLevel": "string",
+        "_certificationLevelMin": "int64", "_certificationLevelMax": "int64"
+    },
+    "pois": {
+        "playerFacingName": "string", "description": "string", "_slug": "string", "location": "vector",
+        "mapLocation": "vector", "levelDefinitionId": "ref"
+    }
+}
+
+# `section` isn't stored in the files. It comes from the `section=...` folder, like any Hive partition column.
+_COMMON_COLUMNS = {"guid": "string", "name": "string", "typeId": "string"}
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("PARQUET needs the `pyarrow` package: pip install pyarrow")
+
+
+def _arrow_field(name: str, kind: str):
+    if kind == "json":
+        return pa.field(name, pa.string(), metadata={"encoding": "json"})
+    if kind == "ref":
+        return pa.field(name, pa.struct([("guid", pa.string()), ("typeId", pa.string()), ("name", pa.string())]))
+    if kind == "vector":
+        return pa.field(name, pa.struct([("x", pa.float64()), ("y", pa.float64()), ("z", pa.float64())]))
+    types = {"string": pa.string(), "int64": pa.int64(), "float64": pa.float64(), "bool": pa.bool_()}
+    if kind not in types:
+        raise ValueError(f"Unknown Parquet column kind `{kind}` for `{name}`")
+    return pa.field(name, types[kind])
+
+
+def _columns(section: str) -> dict:
+    return {**_COMMON_COLUMNS, **SECTION_COLUMNS.get(section, {}), "data": "json"}
+
+
+def section_schema(section: str):
+    _require_pyarrow()
+    return pa.schema([_arrow_field(name, kind) for name, kind in _columns(section).items()])
+
+
+def _number(value, cast):
+    if isinstance(value, bool) or value is None:
+        return None
+    try:
+        return cast(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def _coerce(value, kind: str):
+    """`value` as a column of `kind`, or None when it doesn't fit"""
+    if value is None:
+        return None
+    if kind == "json":
+        return codec_tools.dumps(value).decode("utf-8")
+    if kind == "string":
+        if isinstance(value, (dict, list)):
+            return codec_tools.dumps(value).decode("utf-8")
+        return str(value)
+    if kind == "int64":
+        number = _number(value, int)
+        return number if number is None or -2 ** 63 <= number < 2 ** 63 else None
+    if kind == "float64":
+        return _number(value, float)
+    if kind == "bool":
+        return value if isinstance(value, bool) else None
+    if not isinstance(value, dict):
+        return None
+    if kind == "ref":
+        return {key: None if value.get(key) is None else str(value[key]) for key in ("guid", "typeId", "name")}
+    if kind == "vector":
+        return {key: _number(value.get(key), float) for key in ("x", "y", "z")}
+    return None
+
+
+class ParquetSectionWriter:
+    """
+    Writes one section's rows to Parquet as pages arrive.
+
+    Rows are buffered until `row_group_rows` of them are waiting, then written as one row group. A part file is
+    closed after the page that takes it to `file_rows` rows, and `write()` returns True: everything written so far is
+    on disk, and the section's checkpoint can move forward. A resumed section (`parts` > 0) keeps its finished part
+    files and drops anything after them.
+
+    Parts are written to a hidden `.section={section}.partial` folder, which replaces `section={section}` in
+    `finish()`, so readers never see half a snapshot.
+    """
+
+    def __init__(self, root: str, section: str, row_group_rows: int = 5000, file_rows: int = 50000,
+                 compression: str = "zstd", parts: int = 0, count: int = 0):
+        _require_pyarrow()
+        self.section = section
+        self.path = os.path.join(root, f"section={section}")
+        self.partial_path = os.path.join(root, f".section={section}.partial")
+        self.schema = section_schema(section)
+        self.row_group_rows = max(1, int(row_group_rows))
+        self.file_rows = max(self.row_group_rows, int(file_rows))
+        self.compression = compression or "none"
+        self.parts = parts
+        self.count = count
+        self._columns = _columns(section)
+        self._buffer = []
+        self._writer = None
+        self._file_rows = 0
+
+        if parts == 0 and os.path.isdir(self.partial_path):
+            shutil.rmtree(self.partial_path)
+        os.makedirs(self.partial_path, exist_ok=True)
+        for name in os.listdir(self.partial_path):
+            if self._part_number(name) is None or self._part_number(name) >= parts:
+                os.remove(os.path.join(self.partial_path, name))
+
+    @classmethod
+    def for_section(cls, output_dir: str, section: str, parquet_config: dict, delta: bool = False,
+                    parts: int = 0, count: int = 0) -> "ParquetSectionWriter":
+        return cls(cls.root(output_dir, delta), section,
+                   row_group_rows=parquet_config.get("ROW_GROUP_ROWS", 5000),
+                   file_rows=parquet_config.get("FILE_ROWS", 50000),
+                   compression=parquet_config.get("COMPRESSION", "zstd"),
+                   parts=parts, count=count)
+
+    @staticmethod
+    def root(output_dir: str, delta: bool = False) -> str:
+        # An incremental run only holds new and changed entities, so it gets a dataset of its own
+        return os.path.join(output_dir, "parquet.delta" if delta else "parquet")
+
+    @staticmethod
+    def _part_number(name: str):
+        if not (name.startswith("part-") and name.endswith(".parquet")):
+            return None
+        try:
+            return int(name[len("part-"):-len(".parquet")])
+        except ValueError:
+            return None
+
+    def _table(self, rows: list):
+        columns = {name: [] for name in self._columns}
+        for row in rows:
+            entity = row.get("data") or {}
+            for name, kind in self._columns.items():
+                if name == "data":
+                    value = entity
+                elif name == "guid":
+                    value = row.get(name)
+                else:
+                    value = entity.get(name)
+                columns[name].append(_coerce(value, kind))
+        return pa.Table.from_pydict(columns, schema=self.schema)
+
+    def _flush_row_group(self, limit: int = None):
+        if not self._buffer:
+            return
+        if self._writer is None:
+            part = os.path.join(self.partial_path, f"part-{self.parts:05d}.parquet")
+            self._writer = pq.ParquetWriter(part, self.schema, compression=self.compression)
+        limit = len(self._buffer) if limit is None else limit
+        rows, self._buffer = self._buffer[:limit], self._buffer[limit:]
+        self._writer.write_table(self._table(rows), row_group_size=len(rows))
+        self._file_rows += len(rows)
+
+    def _close_part(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._writer = None
+        self.parts += 1
+        self.count += self._file_rows
+        self._file_rows = 0
+
+    def write(self, rows: list) -> bool:
+        """Add one page of rows. Returns True when a part file was closed, and everything so far is safely on disk."""
+        self._buffer.extend(rows)
+        while len(self._buffer) >= self.row_group_rows:
+            self._flush_row_group(self.row_group_rows)
+        if self._file_rows + len(self._buffer) < self.file_rows:
+            return False
+        # Parts are only closed between pages, so a checkpoint never lands halfway through one
+        self._flush_row_group()
+        self._close_part()
+        return True
+
+    @property
+    def rows(self) -> int:
+        """Rows written so far, including any still buffered and those from earlier runs' part files"""
+        return self.count + self._file_rows + len(self._buffer)
+
+    def flush(self):
+        """Write what's left to disk, closing the current part file"""
+        self._flush_row_group()
+        self._close_part()
+
+    def finish(self):
+        """Write what's left and move the dataset into place"""
+        self.flush()
+        old_path = f"{self.path}.old"
+        if os.path.isdir(self.path):
+            os.replace(self.path, old_path)
+        os.replace(self.partial_path, self.path)
+        if os.path.isdir(old_path):
+            shutil.rmtree(old_path)
+
+    def close(self):
+        """Stop without finishing. The unfinished part file is dropped when the section is resumed."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def discard(self):
+        """Close and delete everything written, leaving any earlier dataset at `path` untouched"""
+        self.close()
+        shutil.rmtree(self.partial_path, ignore_errors=True)
+
+
+class _ParquetSection(SectionSink):
+    def __init__(self, writer: ParquetSectionWriter, section: str, log, delta: bool = False):
+        self.writer = writer
+        self.section = section
+        self.log = log
+        self.delta = delta
+        self._unsaved_pages = []
+
+    @property
+    def checkpoint(self) -> dict:
+        return {"parts": self.writer.parts, "count": self.writer.count}
+
+    def _saved(self) -> list:
+        pages = [(page, True) for page in self._unsaved_pages]
+        self._unsaved_pages.clear()
+        return pages
+
+    def write_batch(self, page: int, entries: list) -> list:
+        # Pages only count as written once the part file holding them is closed
+        self._unsaved_pages.append(page)
+        return self._saved() if self.writer.write(entries) else []
+
+    def flush(self) -> list:
+        self.writer.flush()
+        return self._saved()
+
+    def close(self, finished: bool = True) -> bool:
+        if not finished:
+            self.writer.close()
+            return False
+        saved = self.writer.rows
+        if saved:
+            self.writer.finish()
+            self.log(f"\033[0;32mSaved {saved} entries to {self.writer.path}\033[0m")
+        elif self.delta:
+            # An empty delta still replaces the last one, or it would be read as this run's changes
+            self.writer.finish()
+            self.log(f"\033[0;33mNo changes for section `{self.section}`, {self.writer.path} is empty\033[0m")
+        else:
+            self.writer.discard()
+            self.log(f"\033[0;33mNo data saved for section `{self.section}`\033[0m")
+        return bool(saved)
+
+
+class ParquetSink(Sink):
+    """The PARQUET scrape method: a Parquet dataset per section under `output_dir/parquet` (see `PARQUET`)"""
+    method = "PARQUET"
+    tag_data = False
+
+    def __init__(self, config: dict, output_dir: str = "data"):
+        # Before any section starts, so a missing pyarrow stops the run instead of every section
+        _require_pyarrow()
+        super().__init__(config, output_dir)
+        self.parquet_config = config.get("PARQUET", {})
+        self.destination = f"{ParquetSectionWriter.root(output_dir)}/"
+        os.makedirs(output_dir, exist_ok=True)
+
+    def open(self, section, log, progress=None, delta=False) -> _ParquetSection:
+        # The checkpoint only moves when a part file is closed. Pages after that are fetched again on resume.
+        checkpoint = {}
+        if progress is not None:
+            root = ParquetSectionWriter.root(self.output_dir, delta)
+            partial_path = os.path.join(root, f".section={section}.partial")
+            if progress.resumed and not os.path.isdir(partial_path):
+                log(f"\033[0;33m{partial_path} is missing, starting `{section}` over.\033[0m")
+                progress.restart()
+            checkpoint = progress.checkpoint
+        writer = ParquetSectionWriter.for_section(self.output_dir, section, self.parquet_config, delta,
+                                                  parts=checkpoint.get("parts", 0), count=checkpoint.get("count", 0))
+        return _ParquetSection(writer, section, log, delta)
@@ -1,14 +1,23 @@
 import os
 import json
+import threading
 from typing import Optional
 from dataclasses import dataclass, field
 
-from supabase import create_client
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from tools.compression_tools import accept_encoding
 
 
 __all__ = (
     'Info',
     'get_supabase_client',
+    'get_http_session',
+    'get_db_pool',
+    'close_clients',
+    'API_URL',
     'CONFIG_FILE',
     'COLOR_CODES',
     'load_config',
@@ -19,6 +28,8 @@ __all__ = (
 # import config
 CONFIG_FILE = 'config.json'
 
+API_URL = "https://api.ashescodex.com"
+
 COLOR_CODES = {
     "RED": "\033[0;31m",
     "GREEN": "\033[0;32m",
@@ -129,8 +140,105 @@ class InfoManager:
 Info = InfoManager()
 
 
+# Long-lived clients, shared by every section and page. Built on first use, see `close_clients()`.
+# supabase and psycopg2 are imported with their client, so only DB runs pay for loading them.
+_clients_lock = threading.Lock()
+_http_session: Optional[requests.Session] = None
+_supabase_client = None
+_db_pool: Optional["psycopg2.pool.ThreadedConnectionPool"] = None
+
+
 def get_supabase_client():
-    return create_client(Info.supabase_url, Info.supabase_key)
+    global _supabase_client
+    with _clients_lock:
+        if _supabase_client is None:
+            from supabase import create_client
+            _supabase_client = create_client(Info.supabase_url, Info.supabase_key)
+        return _supabase_client
+
+
+def get_http_session(config: Optional[dict] = None) -> requests.Session:
+    """
+    Pooled keep-alive session for the Ashes Codex API (or `config["API_URL"]`, when it points somewhere else).
+    `config["HTTP"]` is read on the first call only:
+    POOL_SIZE - connections kept open to the API (keep this >= CONCURRENCY.REQUESTS)
+    RETRIES   - retries on connections that could not be opened or dropped. HTTP errors (429, 5xx) and timeouts are
+                left to the scraper, which retries them under the rate limiter.
+    ACCEPT_ENCODING - "auto" to ask for the best compression that can be decoded here, or a list like ["gzip"]
+    """
+    global _http_session
+    with _clients_lock:
+        if _http_session is None:
+            http_config = (config or {}).get("HTTP", {})
+            pool_size = int(http_config.get("POOL_SIZE", 10))
+            retries = Retry(
+                total=int(http_config.get("RETRIES", 3)),
+                read=0,
+                # No status retries: with the scraper's own 5xx retries on top, one page could cost ~24 requests
+                status=0,
+                allowed_methods=frozenset({"GET"}),
+                backoff_factor=0.5,
+                raise_on_status=False,
+                respect_retry_after_header=False
+            )
+            session = requests.Session()
+            session.headers["Accept-Encoding"] = accept_encoding(http_config.get("ACCEPT_ENCODING", "auto"))
+            session.mount((config or {}).get("API_URL", API_URL),
+                          HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retries))
+            _http_session = session
+        return _http_session
+
+
+def get_db_pool(config: Optional[dict] = None) -> "psycopg2.pool.ThreadedConnectionPool":
+    """
+    Direct Postgres connections, shared by every section. Connections are opened as needed, up to
+    `config["DB_LOADER"]["POOL_SIZE"]` (read on the first call only).
+    """
+    global _db_pool
+    with _clients_lock:
+        if _db_pool is None:
+            if not all([Info.host, Info.user, Info.password]):
+                raise RuntimeError("Database configuration not loaded properly!")
+            import psycopg2.pool
+            pool_size = int((config or {}).get("DB_LOADER", {}).get("POOL_SIZE", 4))
+            _db_pool = psycopg2.pool.ThreadedConnectionPool(
+                1, max(1, pool_size),
+                user=Info.user,
+                password=Info.password,
+                host=Info.host,
+                port=Info.port
+            )
+        return _db_pool
+
+
+def close_clients():
+    """Close the shared HTTP session and database pool, and drop the Supabase client. They are rebuilt on next use."""
+    global _http_session, _supabase_client, _db_pool
+    with _clients_lock:
+        if _http_session is not None:
+            _http_session.close()
+        if _db_pool is not None:
+            _db_pool.closeall()
+        _http_session = None
+        _supabase_client = None
+        _db_pool = None
+
+
+def _forget_clients():
+    """
+    Runs in a forked child. Its copies of the parent's connections share the parent's sockets, so replies to one
+    process could be read by the other. The child starts its own clients. The old ones are kept referenced, as
+    closing or collecting them would shut connections the parent is still using.
+    """
+    global _clients_lock, _http_session, _supabase_client, _db_pool
+    _inherited_clients.append((_http_session, _supabase_client, _db_pool))
+    _clients_lock = threading.Lock()
+    _http_session = _supabase_client = _db_pool = None
+
+
+_inherited_clients = []
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_clients)
 
 
 def load_config(config_file: str):
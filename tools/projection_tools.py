@@ -0,0 +1,179 @@
+"""
+Per-section field projection, run on every entity before it is hashed and stored. Most of an entity's bytes are fields
+nobody queries: icon asset paths, empty tag blocks, `{"guid": "0", "name": "None"}` placeholders. Leaving them out
+shrinks the database rows, the PostgREST payloads and the exported files alike.
+
+Paths are dotted keys (`statBlock.stats`), `*` matches any key, and lists are looked through, so
+`_vendorInventory.listings.itemId` (or `_vendorInventory[].listings[].itemId`, as the reference index writes it)
+reaches the field in every listing.
+"""
+from dataclasses import dataclass, field
+from typing import Optional
+
+from tools import codec_tools
+
+__all__ = (
+    'Projection',
+    'ProjectionStats'
+)
+
+# A reference with one of these guids points at nothing
+_NULL_GUIDS = {"", "0", "None"}
+
+# Marks the end of a path in a path tree. JSON keys are always strings, so it can't clash with one, and unlike a
+# sentinel object it is still the same key once a projection is pickled over to a transform process.
+_END = None
+
+
+def _path_tree(paths) -> dict:
+    tree = {}
+    for path in paths:
+        node = tree
+        for part in str(path).replace("[]", "").split("."):
+            if part:
+                node = node.setdefault(part, {})
+        node[_END] = True
+    return tree
+
+
+def _size(key, value) -> int:
+    # Roughly what the field took up in the stored JSON: "key":value,
+    return len(codec_tools.dumps(value)) + (len(str(key)) + 4 if key is not None else 1)
+
+
+def _is_null_reference(value) -> bool:
+    return isinstance(value, dict) and "guid" in value and (value["guid"] is None or str(value["guid"]) in _NULL_GUIDS)
+
+
+def _is_empty(value) -> bool:
+    return value is None or value == "None" or (isinstance(value, (dict, list)) and not value)
+
+
+@dataclass
+class ProjectionStats:
+    """What a projection dropped. Adds up across pages, and across the transform processes' results."""
+    fields: int = 0
+    references: int = 0
+    arrays: int = 0
+    bytes: int = 0
+
+    def add(self, other: "ProjectionStats"):
+        self.fields += other.fields
+        self.references += other.references
+        self.arrays += other.arrays
+        self.bytes += other.bytes
+
+    def summary(self) -> str:
+        return (f"{self.fields} fields and {self.references} null references dropped | {self.arrays} arrays truncated "
+                f"| about {self.bytes / 1024:,.1f} KB saved")
+
+
+@dataclass
+class Projection:
+    """
+    How one section's entities are cut down. `include` keeps only those paths (everything when empty), `exclude`
+    drops them. `drop_null_references` drops references to guid "0" (or none), `drop_empty` drops null, "None" and
+    empty values, and `max_array` keeps only the first that many items of any list (0 keeps them all).
+    """
+    include: list = field(default_factory=list)
+    exclude: list = field(default_factory=list)
+    drop_null_references: bool = False
+    drop_empty: bool = False
+    max_array: int = 0
+
+    def __post_init__(self):
+        self._include = _path_tree(self.include)
+        self._exclude = _path_tree(self.exclude)
+        self.max_array = max(0, int(self.max_array or 0))
+
+    @classmethod
+    def from_config(cls, config: dict, section: str) -> Optional["Projection"]:
+        """
+        `section`'s projection under PROJECTION in config.json: its entry in SECTIONS on top of DEFAULT. None when
+        projection is turned off, or leaves the section as it is.
+        """
+        projection_config = config.get("PROJECTION", {})
+        if not projection_config.get("ENABLED"):
+            return None
+        rules = {**projection_config.get("DEFAULT", {}), **projection_config.get("SECTIONS", {}).get(section, {})}
+        projection = cls(include=rules.get("INCLUDE", []),
+                         exclude=rules.get("EXCLUDE", []),
+                         drop_null_references=rules.get("DROP_NULL_REFS", False),
+                         drop_empty=rules.get("DROP_EMPTY", False),
+                         max_array=rules.get("MAX_ARRAY", 0))
+        return projection if projection.active else None
+
+    @property
+    def active(self) -> bool:
+        return bool(self.include or self.exclude or self.drop_null_references or self.drop_empty or self.max_array)
+
+    def apply(self, entity: dict, stats: ProjectionStats) -> dict:
+        """Cut `entity` down in place, adding what was dropped to `stats`. Returns `entity`."""
+        if self._include:
+            self._keep(entity, self._include, stats)
+        if self._exclude:
+            self._drop(entity, self._exclude, stats)
+        if self.drop_null_references or self.drop_empty or self.max_array:
+            self._prune(entity, stats)
+        return entity
+
+    def _keep(self, value, tree: dict, stats: ProjectionStats):
+        if _END in tree:
+            return
+        if isinstance(value, list):
+            for item in value:
+                self._keep(item, tree, stats)
+        elif isinstance(value, dict):
+            for key in list(value):
+                subtree = tree.get(key, tree.get("*"))
+                if subtree is None:
+                    stats.fields += 1
+                    stats.bytes += _size(key, value.pop(key))
+                else:
+                    self._keep(value[key], subtree, stats)
+
+    def _drop(self, value, tree: dict, stats: ProjectionStats):
+        if isinstance(value, list):
+            for item in value:
+                self._drop(item, tree, stats)
+        elif isinstance(value, dict):
+            for key in list(value):
+                subtree = tree.get(key, tree.get("*"))
+                if subtree is None:
+                    continue
+                if _END in subtree:
+                    stats.fields += 1
+                    stats.bytes += _size(key, value.pop(key))
+                else:
+                    self._drop(value[key], subtree, stats)
+
+    def _droppable(self, value, stats: ProjectionStats) -> bool:
+        if self.drop_null_references and _is_null_reference(value):
+            stats.references += 1
+            return True
+        if self.drop_empty and _is_empty(value):
+            stats.fields += 1
+            return True
+        return False
+
+    def _prune(self, value, stats: ProjectionStats):
+        if isinstance(value, list):
+            if self.max_array and len(value) > self.max_array:
+                stats.arrays += 1
+                stats.bytes += sum(_size(None, item) for item in value[self.max_array:])
+                del value[self.max_array:]
+            kept = []
+            for item in value:
+                if isinstance(item, (dict, list)):
+                    self._prune(item, stats)
+                if self._droppable(item, stats):
+                    stats.bytes += _size(None, item)
+                else:
+                    kept.append(item)
+            value[:] = kept
+        elif isinstance(value, dict):
+            for key, child in list(value.items()):
+                if isinstance(child, (dict, list)):
+                    self._prune(child, stats)
+                if self._droppable(child, stats):
+                    stats.bytes += _size(key, value.pop(key))
@@ -0,0 +1,227 @@
+"""
+Durable work queue of (section, page) tasks, so one refresh can be split over several processes or machines.
+
+    python -m tools.queue_tools seed                 # find every section's pages and queue them
+    python -m tools.queue_tools work                 # run as many of these as you like, on one queue file
+    python -m tools.queue_tools work --shard 0/3     # or give each machine its own queue and a fixed share
+    python -m tools.queue_tools status
+"""
+import argparse
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Optional
+
+from tools.state_tools import STATE_DIR
+
+__all__ = (
+    'QUEUE_PATH',
+    'WorkQueue',
+    'parse_shard'
+)
+
+QUEUE_PATH = os.path.join(STATE_DIR, "queue.sqlite")
+
+_STATES = ("pending", "leased", "done", "failed")
+
+
+def parse_shard(shard: Optional[str]) -> Optional[tuple]:
+    """`"i/n"` as `(i, n)`, with 0 <= i < n. None stays None."""
+    if not shard:
+        return None
+    try:
+        index, count = (int(part) for part in shard.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard `{shard}` should look like i/n, e.g. 0/4") from None
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Shard `{shard}` is out of range. Expected 0 <= i < n")
+    return index, count
+
+
+def _slot(section: str, page: int) -> int:
+    # Stable across machines and Python versions, unlike hash()
+    return zlib.crc32(f"{section}:{page}".encode("utf-8"))
+
+
+class WorkQueue:
+    """
+    Tasks live in SQLite, so any number of worker processes can share one queue file, and nothing is lost when one
+    of them dies.
+
+    A worker leases a task for `lease_seconds`. `done()` retires it once its rows are written. `fail()` puts it back
+    with a doubling delay, or gives up after `max_attempts`. A task whose worker crashed is leased again once its lease
+    runs out, and counts as an attempt. Every task has a fixed slot, so a `(i, n)` shard always takes the same tasks.
+    """
+
+    def __init__(self, path: str = QUEUE_PATH, lease_seconds: float = 300, max_attempts: int = 5,
+                 retry_delay: float = 5):
+        self.path = path
+        self.lease_seconds = float(lease_seconds)
+        self.max_attempts = max(1, int(max_attempts))
+        self.retry_delay = float(retry_delay)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        # Autocommit, so leases can take the write lock up front with BEGIN IMMEDIATE
+        self._connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                "section TEXT NOT NULL, page INTEGER NOT NULL, slot INTEGER NOT NULL, "
+                "state TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, "
+                "owner TEXT, available_at REAL NOT NULL DEFAULT 0, error TEXT, "
+                "PRIMARY KEY (section, page)) WITHOUT ROWID"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, available_at)")
+
+    @classmethod
+    def from_config(cls, config: dict, path: str = None) -> "WorkQueue":
+        queue_config = config.get("QUEUE", {})
+        return cls(path or queue_config.get("PATH") or QUEUE_PATH,
+                   lease_seconds=queue_config.get("LEASE_SECONDS", 300),
+                   max_attempts=queue_config.get("MAX_ATTEMPTS", 5),
+                   retry_delay=queue_config.get("RETRY_DELAY", 5))
+
+    def add(self, section: str, pages) -> int:
+        """Queue `pages` of `section`. Pages already queued are left as they are. Returns how many were added."""
+        rows = [(section, int(page), _slot(section, int(page))) for page in pages]
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                cursor = self._connection.executemany(
+                    "INSERT OR IGNORE INTO tasks (section, page, slot) VALUES (?, ?, ?)", rows)
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            return cursor.rowcount
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM tasks")
+
+    def lease(self, owner: str, shard: tuple = None) -> Optional[tuple]:
+        """Take the next available task as `(section, page)`, or None when there is nothing to take right now"""
+        sql = ("SELECT section, page, attempts FROM tasks "
+               "WHERE state IN ('pending', 'leased') AND available_at <= ?")
+        now = time.time()
+        params = [now]
+        if shard is not None:
+            sql += " AND slot % ? = ?"
+            params += [shard[1], shard[0]]
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                while True:
+                    row = self._connection.execute(f"{sql} ORDER BY section, page LIMIT 1", params).fetchone()
+                    if row is None:
+                        self._connection.execute("COMMIT")
+                        return None
+                    section, page, attempts = row
+                    if attempts >= self.max_attempts:
+                        # Its worker died holding it on the last attempt
+                        self._connection.execute(
+                            "UPDATE tasks SET state = 'failed', error = COALESCE(error, 'lease expired') "
+                            "WHERE section = ? AND page = ?", (section, page))
+                        continue
+                    self._connection.execute(
+                        "UPDATE tasks SET state = 'leased', owner = ?, attempts = attempts + 1, available_at = ? "
+                        "WHERE section = ? AND page = ?", (owner, now + self.lease_seconds, section, page))
+                    self._connection.execute("COMMIT")
+                    return section, page
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def done(self, section: str, page: int):
+        with self._lock:
+            self._connection.execute(
+                "UPDATE tasks SET state = 'done', owner = NULL, error = NULL WHERE section = ? AND page = ?",
+                (section, page))
+
+    def fail(self, section: str, page: int, error: str) -> bool:
+        """
+        Put a task back to be retried later, or mark it failed once it has used up its attempts. Returns True when
+        it is failed.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT attempts FROM tasks WHERE section = ? AND page = ?", (section, page)).fetchone()
+            attempts = row[0] if row else self.max_attempts
+            state = "failed" if attempts >= self.max_attempts else "pending"
+            delay = self.retry_delay * 2 ** max(0, attempts - 1)
+            self._connection.execute(
+                "UPDATE tasks SET state = ?, owner = NULL, error = ?, available_at = ? WHERE section = ? AND page = ?",
+                (state, str(error)[:1000], time.time() + delay, section, page))
+            return state == "failed"
+
+    def remaining(self, shard: tuple = None) -> int:
+        """Tasks not yet done or failed, leased ones included"""
+        sql = "SELECT COUNT(*) FROM tasks WHERE state IN ('pending', 'leased')"
+        params = ()
+        if shard is not None:
+            sql += " AND slot % ? = ?"
+            params = (shard[1], shard[0])
+        with self._lock:
+            return self._connection.execute(sql, params).fetchone()[0]
+
+    def counts(self) -> dict:
+        """`{section: {state: tasks}}`"""
+        counts = {}
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT section, state, COUNT(*) FROM tasks GROUP BY section, state ORDER BY section").fetchall()
+        for section, state, count in rows:
+            counts.setdefault(section, dict.fromkeys(_STATES, 0))[state] = count
+        return counts
+
+    def failures(self, limit: int = 20) -> list:
+        """`(section, page, attempts, error)` for failed tasks"""
+        with self._lock:
+            return self._connection.execute(
+                "SELECT section, page, attempts, error FROM tasks WHERE state = 'failed' ORDER BY section, page "
+                "LIMIT ?", (int(limit),)).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split a scrape over several workers with a shared task queue")
+    parser.add_argument("--path", help=f"queue file (default QUEUE.PATH, or {QUEUE_PATH})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    seed = commands.add_parser("seed", help="find the pages of every configured section and queue them")
+    seed.add_argument("--reset", action="store_true", help="drop every task first, to start a new refresh")
+    work = commands.add_parser("work", help="lease and scrape tasks until the queue is empty")
+    work.add_argument("--shard", help="only take this share of the tasks, as i/n (0-based)")
+    work.add_argument("--worker", help="name shown in the queue for this worker's leases")
+    commands.add_parser("status", help="tasks per section and state")
+    args = parser.parse_args()
+
+    # Imported here, as table_tools builds on this module
+    from tools import program_tools, table_tools
+
+    config = program_tools.load_config(program_tools.CONFIG_FILE)
+    if args.command == "seed":
+        table_tools.seed_queue(config, args.path, reset=args.reset)
+    elif args.command == "work":
+        worker = args.worker or f"{socket.gethostname()}-{os.getpid()}"
+        try:
+            table_tools.scrape_from_queue(config, args.path, parse_shard(args.shard), worker)
+        except ValueError as e:
+            raise SystemExit(f"\033[0;31m{e}\033[0m")
+    else:
+        queue = WorkQueue.from_config(config, args.path)
+        for section, states in queue.counts().items():
+            print(f"{section:<20}" + "".join(f"{state} {count:<8}" for state, count in states.items()))
+        for section, page, attempts, error in queue.failures():
+            print(f"\033[0;31mFailed\033[0m {section} page {page} after {attempts} attempts: {error}")
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+
+__all__ = (
+    'RateLimiter',
+)
+
+
+@dataclass
+class RateLimiter:
+    """
+    Token bucket shared by every worker, with the refill rate tuned by AIMD.
+
+    Healthy responses raise the rate by about `increase` requests/sec for every second of traffic. A 429, 5xx or
+    timeout multiplies it by `decrease` (at most once per second, so a burst of failures from parallel workers
+    only counts once). A 429 also pauses every worker until its Retry-After has passed.
+
+    start/min_rate/max_rate: Requests per second.
+    attempts:                Tries per page before giving up on it.
+    backoff/max_backoff:     Base and cap, in seconds, of the jittered exponential backoff between tries.
+    """
+    start: float = 4.0
+    min_rate: float = 0.5
+    max_rate: float = 20.0
+    increase: float = 0.25
+    decrease: float = 0.5
+    attempts: int = 6
+    backoff: float = 2.0
+    max_backoff: float = 60.0
+    rate: float = field(init=False)
+    _tokens: float = field(init=False, repr=False)
+    _updated: float = field(init=False, repr=False)
+    _paused_until: float = field(init=False, repr=False)
+    _last_decrease: float = field(init=False, repr=False)
+    _lock: threading.Lock = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.rate = min(max(self.start, self.min_rate), self.max_rate)
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: dict) -> "RateLimiter":
+        rate_config = config.get("RATE_LIMIT", {})
+        return cls(
+            start=float(rate_config.get("START", cls.start)),
+            min_rate=float(rate_config.get("MIN", cls.min_rate)),
+            max_rate=float(rate_config.get("MAX", cls.max_rate)),
+            increase=float(rate_config.get("INCREASE", cls.increase)),
+            decrease=float(rate_config.get("DECREASE", cls.decrease)),
+            attempts=int(rate_config.get("ATTEMPTS", cls.attempts)),
+            backoff=float(rate_config.get("BACKOFF", cls.backoff)),
+            max_backoff=float(rate_config.get("MAX_BACKOFF", cls.max_backoff))
+        )
+
+    @property
+    def burst(self) -> float:
+        # Allow up to one second of traffic to go out at once
+        return max(1.0, self.rate)
+
+    def acquire(self):
+        """Block until this worker may send a request"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.burst, self._tokens + max(0.0, now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def failure(self, attempt: int) -> float:
+        """Record a 5xx or timeout. Returns how long this worker should wait before its next try."""
+        self._slow_down()
+        return self.delay(attempt)
+
+    def throttled(self, attempt: int, retry_after=None) -> float:
+        """
+        Record a 429. Every worker is paused until `retry_after` (or the backoff, if the API didn't send one)
+        has passed. Returns the pause in seconds; `acquire()` already waits it out.
+        """
+        self._slow_down()
+        try:
+            pause = float(retry_after)
+        except (TypeError, ValueError):
+            pause = self.delay(attempt)
+
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+            self._tokens = 0.0
+            self._updated = self._paused_until
+        return pause
+
+    def delay(self, attempt: int) -> float:
+        """Jittered exponential backoff for try number `attempt` (0 based)"""
+        ceiling = min(self.max_backoff, self.backoff * (2 ** attempt))
+        return random.uniform(ceiling / 2, ceiling)
+
+    def _slow_down(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease >= 1.0:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._last_decrease = now
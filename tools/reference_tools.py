@@ -0,0 +1,236 @@
+"""
+Cross-section reference index. Entities point at each other with `{"guid", "typeId", "name"}` blobs (an item's
+`statBlockId`, an NPC's `_vendorInventory` listings, ...). This keeps every such edge, in both directions, so
+"what sells/drops/uses this?" is an index lookup instead of a scan over every section.
+
+    python -m tools.reference_tools 6064630141156262046            # the entity, what it references, what references it
+    python -m tools.reference_tools 6064630141156262046 --in --hops 2
+"""
+import argparse
+import os
+import sqlite3
+import threading
+from collections import deque
+from typing import Optional
+
+from tools.state_tools import STATE_DIR
+
+__all__ = (
+    'ReferenceIndex',
+    'description',
+    'display_name',
+    'extract_references',
+    'index_rows'
+)
+
+# Fields an entity's display name is read from, in order. Sections each use their own.
+_NAME_FIELDS = ("itemName", "abilityName", "effectName", "_characterName", "_displayName", "name")
+
+# Fields an entity's description is read from, in order
+_DESCRIPTION_FIELDS = ("description", "abilityDescription", "effectDescription", "_summary")
+
+# A guid of "0" is the API's null reference
+_NULL_GUIDS = {"", "0", "None"}
+
+
+def display_name(entity: dict) -> Optional[str]:
+    """The entity's human-readable name, whichever field its section keeps it in"""
+    for field in _NAME_FIELDS:
+        value = entity.get(field)
+        if isinstance(value, str) and value and value != "None":
+            return value
+    return None
+
+
+def description(entity: dict) -> Optional[str]:
+    """The entity's description, whichever field its section keeps it in"""
+    for field in _DESCRIPTION_FIELDS:
+        value = entity.get(field)
+        if isinstance(value, str) and value and value != "None":
+            return value
+    return None
+
+
+def extract_references(entity: dict) -> list:
+    """
+    Every `{"guid": ...}` reference nested anywhere in `entity`, as `(guid, typeId, path)`. The path says where it
+    was found, with list positions as `[]` and numbered keys as `*`, e.g. `_vendorInventory[].listings[].itemId`.
+    """
+    references = []
+    stack = [(value, key) for key, value in entity.items() if isinstance(value, (dict, list))]
+    while stack:
+        value, path = stack.pop()
+        if isinstance(value, list):
+            stack.extend((item, f"{path}[]") for item in value if isinstance(item, (dict, list)))
+            continue
+        guid = value.get("guid")
+        if isinstance(guid, (str, int)) and str(guid) not in _NULL_GUIDS:
+            type_id = value.get("typeId")
+            references.append((str(guid), None if type_id is None else str(type_id), path))
+        for key, child in value.items():
+            if isinstance(child, (dict, list)):
+                stack.append((child, f"{path}.*" if key.isdigit() else f"{path}.{key}"))
+    return references
+
+
+def index_rows(section: str, rows: list) -> tuple:
+    """A page of `codex` rows (`{"guid", "section", "data"}`) as the `(entities, edges)` that `add_indexed()` stores"""
+    entities, edges = [], []
+    for row in rows:
+        guid, entity = row.get("guid"), row.get("data") or {}
+        if not guid:
+            continue
+        guid = str(guid)
+        type_id = entity.get("typeId")
+        entities.append((guid, section, display_name(entity), None if type_id is None else str(type_id)))
+        edges.extend((guid, target, path, target_type)
+                     for target, target_type, path in extract_references(entity) if target != guid)
+    return entities, edges
+
+
+class ReferenceIndex:
+    """
+    guid -> entity, entity -> referenced guids, and the reverse edges, stored in SQLite.
+
+    Lookups are single index probes on WITHOUT ROWID tables, and the file is memory-mapped for reading, so opening a
+    large index costs nothing up front. `add()` replaces a page's entities and their outgoing edges, so re-scraping
+    a section keeps the index current. Safe to share between threads.
+    """
+
+    def __init__(self, path: str, mmap_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(f"PRAGMA mmap_size={int(mmap_bytes)}")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS entities ("
+                "guid TEXT PRIMARY KEY, section TEXT NOT NULL, name TEXT, type_id TEXT) WITHOUT ROWID"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS refs ("
+                "source TEXT NOT NULL, target TEXT NOT NULL, path TEXT NOT NULL, target_type TEXT, "
+                "PRIMARY KEY (source, target, path)) WITHOUT ROWID"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS refs_target ON refs (target, source)")
+
+    @classmethod
+    def from_config(cls, config: dict) -> Optional["ReferenceIndex"]:
+        """The index under REFERENCES in config.json, or None when it is turned off"""
+        reference_config = config.get("REFERENCES", {})
+        if not reference_config.get("ENABLED"):
+            return None
+        return cls(reference_config.get("PATH") or os.path.join(STATE_DIR, "references.sqlite"))
+
+    def add(self, section: str, rows: list):
+        """Index one page of `codex` rows (`{"guid", "section", "data"}`)"""
+        self.add_indexed(*index_rows(section, rows))
+
+    def add_indexed(self, entities: list, edges: list):
+        """Store what `index_rows()` found, when that ran somewhere else (a transform process)"""
+        if not entities:
+            return
+
+        with self._lock, self._connection:
+            self._connection.executemany("DELETE FROM refs WHERE source = ?", [(entity[0],) for entity in entities])
+            self._connection.executemany("INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?)", entities)
+            self._connection.executemany("INSERT OR IGNORE INTO refs VALUES (?, ?, ?, ?)", edges)
+
+    def entity(self, guid: str) -> Optional[dict]:
+        """`{"guid", "section", "name", "typeId"}` for an entity that has been scraped, else None"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT guid, section, name, type_id FROM entities WHERE guid = ?", (str(guid),)).fetchone()
+        return None if row is None else dict(zip(("guid", "section", "name", "typeId"), row))
+
+    def outgoing(self, guid: str) -> list:
+        """What `guid` references, as `(target, path, typeId)`"""
+        with self._lock:
+            return self._connection.execute(
+                "SELECT target, path, target_type FROM refs WHERE source = ? ORDER BY path, target",
+                (str(guid),)).fetchall()
+
+    def incoming(self, guid: str) -> list:
+        """What references `guid`, as `(source, path)`"""
+        with self._lock:
+            return self._connection.execute(
+                "SELECT source, path FROM refs WHERE target = ? ORDER BY path, source", (str(guid),)).fetchall()
+
+    def traverse(self, guid: str, hops: int = 1, direction: str = "out") -> dict:
+        """
+        Every guid within `hops` edges of `guid`, mapped to how many hops away it is. `direction` is "out" (what it
+        references), "in" (what references it), or "both".
+        """
+        if direction not in ("out", "in", "both"):
+            raise ValueError(f"Unknown direction `{direction}`. Expected out, in or both")
+        start = str(guid)
+        distances = {start: 0}
+        queue = deque([start])
+        while queue:
+            current = queue.popleft()
+            if distances[current] >= hops:
+                continue
+            neighbours = []
+            if direction in ("out", "both"):
+                neighbours += [target for target, _, _ in self.outgoing(current)]
+            if direction in ("in", "both"):
+                neighbours += [source for source, _ in self.incoming(current)]
+            for neighbour in neighbours:
+                if neighbour not in distances:
+                    distances[neighbour] = distances[current] + 1
+                    queue.append(neighbour)
+        del distances[start]
+        return distances
+
+    def counts(self) -> dict:
+        with self._lock:
+            entities = self._connection.execute("SELECT COUNT(*) FROM entities").fetchone()[0]
+            edges = self._connection.execute("SELECT COUNT(*) FROM refs").fetchone()[0]
+        return {"entities": entities, "references": edges}
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def _describe(index: ReferenceIndex, guid: str) -> str:
+    entity = index.entity(guid)
+    if entity is None:
+        return f"{guid} (not scraped)"
+    return f"{guid} [{entity['section']}] {entity['name'] or ''}".rstrip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Look up an entity in the reference index")
+    parser.add_argument("guid")
+    parser.add_argument("--hops", type=int, default=1, help="how many references away to follow")
+    parser.add_argument("--in", dest="incoming", action="store_true", help="only show what references it")
+    parser.add_argument("--out", dest="outgoing", action="store_true", help="only show what it references")
+    parser.add_argument("--path", default=os.path.join(STATE_DIR, "references.sqlite"))
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.path):
+        raise SystemExit(f"No reference index at {args.path}. Set \"ENABLED\": true under REFERENCES and scrape first.")
+    index = ReferenceIndex(args.path)
+    print(_describe(index, args.guid))
+
+    if args.hops == 1:
+        if not args.incoming:
+            print("\nReferences:")
+            for target, path, _ in index.outgoing(args.guid):
+                print(f"  {path:<45} -> {_describe(index, target)}")
+        if not args.outgoing:
+            print("\nReferenced by:")
+            for source, path in index.incoming(args.guid):
+                print(f"  {path:<45} <- {_describe(index, source)}")
+    else:
+        direction = "in" if args.incoming else "out" if args.outgoing else "both"
+        for guid, hops in sorted(index.traverse(args.guid, args.hops, direction).items(), key=lambda item: item[1]):
+            print(f"  {hops} hop{'s' if hops > 1 else ' '}  {_describe(index, guid)}")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Output sinks. Every SCRAPE_METHOD is a `Sink`, and the scrape loop only ever talks to that interface, so adding a
+method is one class and one line in `SINKS`. A sink's module is imported when its method is picked, so a JSON run
+never loads the Supabase and Postgres clients, and a DB run never loads pyarrow.
+"""
+import importlib
+from functools import partial
+
+from tools.deadletter_tools import DeadLetters
+
+__all__ = (
+    'SINKS',
+    'LoaderSection',
+    'Sink',
+    'SectionSink',
+    'open_sink',
+    'sink_class'
+)
+
+# SCRAPE_METHOD -> (module, class). Nothing here is imported until `sink_class()` asks for it.
+SINKS = {
+    "DB": ("tools.db_tools", "DbSink"),
+    "JSON": ("tools.export_tools", "JsonSink"),
+    "PARQUET": ("tools.parquet_tools", "ParquetSink"),
+    "SQLITE": ("tools.sqlite_tools", "SqliteSink"),
+}
+
+
+class SectionSink:
+    """
+    One section's writes to a sink.
+
+    `write_batch()` takes each page's rows, in page order. It returns `(page, stored)` for every page that is now done
+    with, which the scrape loop checkpoints: a sink that writes straight through hands the page back at once, and one
+    that buffers (Parquet) holds pages back until they are safely on disk. `stored` is False for a page that could not
+    be written and was skipped. `flush()` writes anything still buffered at the end of the section, and returns its
+    pages the same way. `close()` ends the section. Unless it is `finished`, output is left as it is, to be resumed.
+    """
+
+    @property
+    def checkpoint(self) -> dict:
+        """Saved with the section's checkpoint after every page, for `Sink.open()` to pick the output back up"""
+        return {}
+
+    def write_batch(self, page: int, entries: list) -> list:
+        raise NotImplementedError
+
+    def flush(self) -> list:
+        return []
+
+    def close(self, finished: bool = True) -> bool:
+        """Returns whether the section saved anything"""
+        return True
+
+
+class LoaderSection(SectionSink):
+    """
+    Writes every page straight through with a loader's `load(entries, section, page, log, failed)`. The loader calls
+    `failed(error, entries)` with the entries it had to skip, which go to `dead_letters` when there are any.
+    """
+
+    def __init__(self, loader, section: str, log, dead_letters: DeadLetters = None):
+        self.loader = loader
+        self.section = section
+        self.log = log
+        self.dead_letters = dead_letters
+
+    def write_batch(self, page: int, entries: list) -> list:
+        failed = partial(self.dead_letters.add_rows, self.section, page) if self.dead_letters is not None else None
+        stored = not entries or self.loader.load(entries, self.section, page, self.log, failed)
+        if stored and self.dead_letters is not None:
+            self.dead_letters.resolve(self.section, page)
+        return [(page, stored)]
+
+
+class Sink:
+    """
+    Where a run's rows go. One sink serves every section of a run, and `open()` starts a section on it.
+
+    `ordered` sinks need a section's pages in order (a file is written front to back), so the work queue, which
+    finishes pages in any order, can only use unordered ones. `output_dir` is where files that aren't rows (the XP
+    tables) are saved, and `destination` is shown when the run is done. With `tag_data`, each row's guid and section
+    are also stored in its `data`. An unordered sink keeps the pages and rows it could not save in `dead_letters`
+    (see tools/deadletter_tools.py), and an ordered one picks a failed page back up from its checkpoint instead.
+    """
+    method = ""
+    ordered = True
+    tag_data = True
+
+    def __init__(self, config: dict, output_dir: str = "data"):
+        self.config = config
+        self.output_dir = output_dir
+        self.destination = output_dir
+        self.dead_letters = None if self.ordered else DeadLetters.from_config(config, self.method)
+
+    def open(self, section: str, log, progress=None, delta: bool = False) -> SectionSink:
+        """
+        Start writing `section`. `progress` is its SectionProgress, for a sink that resumes half-written output,
+        and None when pages are written one at a time by the work queue. `delta` is set on incremental runs.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        if self.dead_letters is not None:
+            self.dead_letters.close()
+
+
+def sink_class(method: str) -> type:
+    """The Sink class for `method`, importing its module"""
+    method = str(method).upper()
+    if method not in SINKS:
+        raise ValueError(f"Unknown SCRAPE_METHOD `{method}`. Expected one of: {', '.join(SINKS)}")
+    module, name = SINKS[method]
+    return getattr(importlib.import_module(module), name)
+
+
+def open_sink(config: dict, method: str = None, output_dir: str = "data") -> Sink:
+    """The sink for `method`, or for SCRAPE_METHOD in config.json"""
+    return sink_class(method or config.get("SCRAPE_METHOD", "DB"))(config, output_dir)
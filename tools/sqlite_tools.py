@@ -0,0 +1,230 @@
+"""
+Local SQLite mirror of the codex table, with full-text search over names and descriptions.
+
+    python -m tools.sqlite_tools search "sword belt"
+    python -m tools.sqlite_tools search "bleed*" --section status-effects
+    python -m tools.sqlite_tools get 6064628793932775728
+    python -m tools.sqlite_tools stats
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+from tools import codec_tools
+from tools.metrics_tools import Metrics
+from tools.reference_tools import description, display_name
+from tools.sink_tools import LoaderSection, Sink
+from tools.transform_tools import EncodedRows
+
+__all__ = (
+    'SQLITE_PATH',
+    'SqliteMirror',
+    'SqliteSink',
+    'description'
+)
+
+SQLITE_PATH = os.path.join("data", "codex.sqlite")
+
+# The FTS table mirrors `name` and `description` from `codex`. The triggers keep it in step with every upsert.
+_FTS_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS codex_fts USING fts5("
+    "name, description, content='codex', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2', "
+    "prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS codex_fts_insert AFTER INSERT ON codex BEGIN "
+    "INSERT INTO codex_fts (rowid, name, description) VALUES (new.rowid, new.name, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS codex_fts_delete AFTER DELETE ON codex BEGIN "
+    "INSERT INTO codex_fts (codex_fts, rowid, name, description) "
+    "VALUES ('delete', old.rowid, old.name, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS codex_fts_update AFTER UPDATE ON codex BEGIN "
+    "INSERT INTO codex_fts (codex_fts, rowid, name, description) "
+    "VALUES ('delete', old.rowid, old.name, old.description); "
+    "INSERT INTO codex_fts (rowid, name, description) VALUES (new.rowid, new.name, new.description); END",
+)
+
+_UPSERT_SQL = (
+    "INSERT INTO codex (guid, section, data, name, description) VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT (guid) DO UPDATE SET section = excluded.section, data = excluded.data, name = excluded.name, "
+    "description = excluded.description "
+    "WHERE codex.data IS NOT excluded.data"
+)
+
+
+class SqliteMirror:
+    """
+    The same guid/section/data rows as the Supabase table, in a local SQLite file. `data` is stored as JSON text,
+    so SQLite's JSON functions work on it (`json_extract(data, '$.level')`).
+
+    Every page is upserted in a single transaction. A row whose data hasn't changed is left alone, so a re-scrape only
+    rewrites (and re-indexes) what changed. `load()` has the same signature as `CopyLoader.load()`, so the DB scrape
+    loop drives it unchanged. Safe to share between threads.
+    """
+
+    def __init__(self, path: str = SQLITE_PATH, mmap_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            # With WAL, NORMAL only risks the last transactions on power loss, never corruption
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(f"PRAGMA mmap_size={int(mmap_bytes)}")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS codex ("
+                "guid TEXT PRIMARY KEY, section TEXT NOT NULL, data TEXT NOT NULL, name TEXT, description TEXT)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS codex_section ON codex (section, name)")
+            try:
+                for statement in _FTS_SQL:
+                    self._connection.execute(statement)
+                self.fts = True
+            except sqlite3.OperationalError:
+                # Python built against an SQLite without FTS5. Search falls back to LIKE.
+                self.fts = False
+
+    @classmethod
+    def from_config(cls, config: dict) -> "SqliteMirror":
+        return cls(config.get("SQLITE", {}).get("PATH") or SQLITE_PATH)
+
+    def upsert(self, entries: list) -> int:
+        """Write `entries` in one transaction. Returns how many rows were added or changed."""
+        if isinstance(entries, EncodedRows):
+            # Already encoded in a transform process
+            rows = [(str(guid), entries.section, data.decode("utf-8"), name, text)
+                    for guid, data, name, text in zip(entries.guids, entries.data, entries.names, entries.descriptions)
+                    if guid]
+        else:
+            rows = self._rows(entries)
+        with self._lock, self._connection:
+            # rowcount leaves out the FTS triggers' writes, and unchanged rows the upsert skipped
+            return self._connection.executemany(_UPSERT_SQL, rows).rowcount
+
+    @staticmethod
+    def _rows(entries: list) -> list:
+        rows = []
+        for entry in entries:
+            if not entry.get("guid"):
+                continue
+            entity = entry.get("data") or {}
+            rows.append((str(entry["guid"]), entry.get("section"), codec_tools.dumps(entity).decode("utf-8"),
+                         display_name(entity), description(entity)))
+        return rows
+
+    def load(self, entries, section, page, log=print, failed=None) -> bool:
+        try:
+            changed = self.upsert(entries)
+        except sqlite3.Error as e:
+            Metrics.inc("codex_write_failures_total", len(entries), section=section)
+            log(f"\033[0;33mSQLite write failed for `{section}` on page {page}. Skipping page.\033[0m\n{e}")
+            if failed is not None:
+                failed(getattr(e, "sqlite_errorname", type(e).__name__), entries)
+            return False
+        log(f"Created or Updated | {changed} total entries for \033[0;32m`{section}`\033[0m page {page}.")
+        return True
+
+    def get(self, guid: str) -> Optional[dict]:
+        """The entity with `guid`, or None"""
+        with self._lock:
+            row = self._connection.execute("SELECT data FROM codex WHERE guid = ?", (str(guid),)).fetchone()
+        return None if row is None else codec_tools.loads(row[0])
+
+    def search(self, query: str, section: str = None, limit: int = 20) -> list:
+        """
+        Full-text search over names and descriptions, best matches first. `query` takes FTS5 syntax: words,
+        "phrases", prefix*, OR/NOT, and `name: word` to search one field.
+        Returns `{"guid", "section", "name", "description"}` dicts.
+        """
+        if self.fts:
+            sql = ("SELECT codex.guid, codex.section, codex.name, codex.description FROM codex_fts "
+                   "JOIN codex ON codex.rowid = codex_fts.rowid WHERE codex_fts MATCH ?")
+            params = [query]
+            order = " ORDER BY bm25(codex_fts, 10.0, 1.0)"
+        else:
+            sql = ("SELECT guid, section, name, description FROM codex "
+                   "WHERE (name LIKE ? OR description LIKE ?)")
+            params = [f"%{query}%", f"%{query}%"]
+            order = " ORDER BY name"
+        if section:
+            sql += " AND codex.section = ?" if self.fts else " AND section = ?"
+            params.append(section)
+        with self._lock:
+            rows = self._connection.execute(f"{sql}{order} LIMIT ?", (*params, int(limit))).fetchall()
+        return [dict(zip(("guid", "section", "name", "description"), row)) for row in rows]
+
+    def section(self, section: str, limit: int = None) -> list:
+        """Every entity in `section`, by name"""
+        sql = "SELECT data FROM codex WHERE section = ? ORDER BY name"
+        params = (section,) if limit is None else (section, int(limit))
+        with self._lock:
+            rows = self._connection.execute(sql if limit is None else f"{sql} LIMIT ?", params).fetchall()
+        return [codec_tools.loads(row[0]) for row in rows]
+
+    def counts(self) -> dict:
+        """Entities per section"""
+        with self._lock:
+            return dict(self._connection.execute(
+                "SELECT section, COUNT(*) FROM codex GROUP BY section ORDER BY section").fetchall())
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class SqliteSink(Sink):
+    """
+    The SQLITE scrape method: every page upserted into the mirror (`SQLITE.PATH`) as it arrives. This is the DB method
+    with a local destination, so it takes pages in any order too. Files that aren't rows go next to the mirror.
+    """
+    method = "SQLITE"
+    ordered = False
+
+    def __init__(self, config: dict, output_dir: str = "data"):
+        self.mirror = SqliteMirror.from_config(config)
+        super().__init__(config, os.path.dirname(self.mirror.path) or ".")
+        self.destination = self.mirror.path
+
+    def open(self, section, log, progress=None, delta=False) -> LoaderSection:
+        return LoaderSection(self.mirror, section, log, self.dead_letters)
+
+    def close(self):
+        self.mirror.close()
+        super().close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the local SQLite mirror")
+    parser.add_argument("--path", default=SQLITE_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    search = commands.add_parser("search", help="full-text search over names and descriptions")
+    search.add_argument("query")
+    search.add_argument("--section")
+    search.add_argument("--limit", type=int, default=20)
+    get = commands.add_parser("get", help="print one entity as JSON")
+    get.add_argument("guid")
+    commands.add_parser("stats", help="entities per section")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.path):
+        raise SystemExit(f"No SQLite mirror at {args.path}. Scrape with the SQLITE method first.")
+    mirror = SqliteMirror(args.path)
+    try:
+        if args.command == "search":
+            for result in mirror.search(args.query, args.section, args.limit):
+                print(f"{result['guid']:<22} \033[0;36m[{result['section']}]\033[0m {result['name'] or ''}")
+        elif args.command == "get":
+            entity = mirror.get(args.guid)
+            if entity is None:
+                raise SystemExit(f"No entity with guid {args.guid}")
+            print(json.dumps(entity, indent=2, ensure_ascii=False))
+        else:
+            for section, count in mirror.counts().items():
+                print(f"{section:<20}{count:>8}")
+    finally:
+        mirror.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+__all__ = (
+    'STATE_DIR',
+    'Checkpoints',
+    'HashIndex',
+    'SectionChanges',
+    'SectionProgress',
+    'atomic_write',
+    'content_hash'
+)
+
+# Local bookkeeping that has to survive between runs
+STATE_DIR = os.path.join("data", ".state")
+
+
+def atomic_write(path: str, data: bytes):
+    """Replace `path` with `data` in one step. A crash leaves either the old file or the new one, never half of each."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def content_hash(data) -> str:
+    """
+    Stable hash of an entity. Keys are sorted so the API reordering fields doesn't count as a change.
+    Always the stdlib encoder: fast codecs format some floats differently, and switching JSON_CODEC shouldn't make
+    every entity look changed.
+    """
+    encoded = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+class Checkpoints:
+    """
+    Per-section progress, so a stopped or crashed run picks up where it left off.
+
+    A checkpoint holds `last_page` (the last page whose write finished) and `pages` (every page written so far).
+    """
+
+    def __init__(self, method: str):
+        self.directory = os.path.join(STATE_DIR, f"checkpoints-{method.lower()}")
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, section: str) -> str:
+        return os.path.join(self.directory, f"{section}.json")
+
+    def load(self, section: str) -> Optional[dict]:
+        try:
+            with open(self.path(section), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, section: str, checkpoint: dict):
+        atomic_write(self.path(section), json.dumps(checkpoint).encode("utf-8"))
+
+    def clear(self, section: str):
+        try:
+            os.remove(self.path(section))
+        except FileNotFoundError:
+            pass
+
+
+class SectionProgress:
+    """One section's checkpoint, moved forward by the write stage after every page"""
+
+    def __init__(self, checkpoints: Checkpoints, section: str):
+        self.checkpoints = checkpoints
+        self.section = section
+        self.resumed = checkpoints.load(section)
+        self.checkpoint = dict(self.resumed or {"last_page": 0, "pages": []})
+
+    @property
+    def start_page(self) -> int:
+        return self.checkpoint["last_page"] + 1
+
+    def advance(self, page: int, **extra):
+        """Mark `page` as written. `extra` is saved alongside, e.g. how far into its output file the section got."""
+        self.checkpoint["last_page"] = page
+        self.checkpoint["pages"].append(page)
+        self.checkpoint.update(extra)
+        self.checkpoints.save(self.section, self.checkpoint)
+
+    def restart(self):
+        """Forget the checkpoint and start the section again from page 1"""
+        self.resumed = None
+        self.checkpoint = {"last_page": 0, "pages": []}
+        self.checkpoints.clear(self.section)
+
+    def finish(self):
+        self.checkpoints.clear(self.section)
+
+
+class HashIndex:
+    """
+    guid -> content hash for every entity already written, keyed by section and stored in SQLite.
+
+    `diff()` splits a page into added/changed/unchanged rows, and `record()` stores the new hashes once the rows
+    have actually been written. Nothing is recorded for a page that failed to write, so it is retried next run.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS entity_hashes ("
+                "section TEXT NOT NULL, guid TEXT NOT NULL, hash TEXT NOT NULL, PRIMARY KEY (section, guid))"
+            )
+
+    @classmethod
+    def for_method(cls, method: str) -> "HashIndex":
+        # Each output keeps its own index. Rows written to the DB say nothing about what is in the JSON files.
+        return cls(os.path.join(STATE_DIR, f"hashes-{method.lower()}.sqlite"))
+
+    def diff(self, section: str, rows: list, hashes: dict = None):
+        """
+        Returns `(rows_to_write, hashes, counts)`. `rows_to_write` holds only new or changed rows, `hashes` is the
+        guid -> hash map to pass to `record()` after they are written, and `counts` has added/changed/unchanged.
+        Pass `hashes` when the rows' content hashes were already worked out elsewhere. Rows that are still encoded
+        (transform_tools.EncodedRows, which always come with their hashes) are filtered on their guids alone.
+        """
+        if hashes is None:
+            hashes = {row["guid"]: content_hash(row["data"]) for row in rows if row.get("guid")}
+        with self._lock:
+            known = dict(self._connection.execute(
+                f"SELECT guid, hash FROM entity_hashes WHERE section = ? AND guid IN ({','.join('?' * len(hashes))})",
+                (section, *hashes)
+            )) if hashes else {}
+
+        counts = {"added": 0, "changed": 0, "unchanged": 0}
+        keep = []
+        guids = rows.guids if hasattr(rows, "subset") else [row.get("guid") for row in rows]
+        for i, guid in enumerate(guids):
+            previous = known.get(guid)
+            if guid and previous == hashes[guid]:
+                counts["unchanged"] += 1
+                continue
+            counts["added" if previous is None else "changed"] += 1
+            keep.append(i)
+
+        changed_rows = rows.subset(keep) if hasattr(rows, "subset") else [rows[i] for i in keep]
+        return changed_rows, {guid: digest for guid, digest in hashes.items() if known.get(guid) != digest}, counts
+
+    def record(self, section: str, hashes: dict):
+        if not hashes:
+            return
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT INTO entity_hashes (section, guid, hash) VALUES (?, ?, ?) "
+                "ON CONFLICT (section, guid) DO UPDATE SET hash = excluded.hash",
+                [(section, guid, digest) for guid, digest in hashes.items()]
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class SectionChanges:
+    """
+    One section's view of a HashIndex while it moves through the pipeline. `filter()` runs in the transform stage,
+    `written()` in the write stage once a page has been saved. Without an index every row is passed through.
+    """
+
+    def __init__(self, index: HashIndex, section: str):
+        self.index = index
+        self.section = section
+        self.counts = {"added": 0, "changed": 0, "unchanged": 0}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def filter(self, page: int, rows: list, hashes: dict = None) -> list:
+        if self.index is None:
+            return rows
+        changed_rows, hashes, counts = self.index.diff(self.section, rows, hashes)
+        with self._lock:
+            self._pending[page] = hashes
+            for key, value in counts.items():
+                self.counts[key] += value
+        return changed_rows
+
+    def written(self, page: int = None):
+        """Record the hashes of `page`, or of every pending page when `page` is None"""
+        if self.index is None:
+            return
+        with self._lock:
+            if page is None:
+                pages, self._pending = list(self._pending.values()), {}
+            else:
+                pages = [self._pending.pop(page, {})]
+        for hashes in pages:
+            self.index.record(self.section, hashes)
+
+    def summary(self) -> str:
+        return (f"{self.counts['added']} added | {self.counts['changed']} changed | "
+                f"{self.counts['unchanged']} unchanged")
@@ -1,130 +1,57 @@
-import json
 import os
-import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, closing, contextmanager, nullcontext
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Callable, ContextManager, Optional
 
 import requests
 
-import postgrest
-import psycopg2
-
-from tools import program_tools
-from tools.program_tools import Info, load_config
+from tools import codec_tools, program_tools
+from tools.cache_tools import ResponseCache
+from tools.engine_tools import Engine, SectionLog, ScrapeStopped
+from tools.metrics_tools import Metrics, start_exporters, stop_exporters
+from tools.projection_tools import Projection, ProjectionStats
+from tools.program_tools import API_URL, Info, load_config
+from tools.queue_tools import WorkQueue
+from tools.rate_tools import RateLimiter
+from tools.reference_tools import ReferenceIndex
+from tools.sink_tools import Sink, open_sink, sink_class
+from tools.state_tools import Checkpoints, HashIndex, SectionChanges, SectionProgress
+from tools.transform_tools import XP_SECTION, is_empty_page, prepare_page, transform_entries
 
 __all__ = (
-    'create_table',
+    'run_scrape',
     'scrape',
-    'scrape_to_json'
+    'scrape_to_json',
+    'scrape_to_parquet',
+    'scrape_to_sqlite',
+    'scrape_from_queue',
+    'seed_queue',
+    'replay_dead_letters'
 )
 
-
-def create_table():
-    if not all([Info.host, Info.user, Info.password]):
-        raise RuntimeError("Database configuration not loaded properly!")
-
-    print(f"Attempting connection to: host={Info.host} port={Info.port} user={Info.user}")
-    try:
-        with psycopg2.connect(
-                user=Info.user,
-                password=Info.password,
-                host=Info.host,
-                port=Info.port
-        ) as connection:
-            print("Connection successful!")
-            with connection.cursor() as cursor:
-                with open('sql/schemas.sql', 'r') as sql_file:
-                    schemas = sql_file.read().strip()
-                    schema_sections = schemas.split('-- ###BREAK')
-                    table_create = schema_sections[1]
-
-                if not table_create:
-                    print("Error: SQL Query is empty!")
-                    return False
-
-                cursor.execute(table_create)
-                connection.commit()
-                print("Table Successfully Created!")
-                return True
-
-    except psycopg2.Error as e:
-        print(f"Database error: {e}")
-        return False
-
-
-def retry_upsert(entries, section, page):
-    s_base = program_tools.get_supabase_client()
-    max_retries = 5
-    retry_count = 0
-    backoff = 2
-
-    while retry_count < max_retries:
-        try:
-            res = s_base.table("codex").upsert(entries).execute()
-
-            if res.data:
-
-                print(f"Created or Updated | {len(res.data)} "
-                      f"total entries for \033[0;32m`{section}`\033[0m page {page}.")
-            else:
-                print(f"No new data inserted for `{section}` on page {page}. Data may already exist.")
-
-            return True
-
-        except postgrest.exceptions.APIError as e:
-            error_code = str(getattr(e, "code", "N/A"))
-            if error_code == "57014":  # Statement timeout
-                print(
-                    f"\033[0;33mError 57014: POST to database timed out on page {page} of section `{section}`. \033[0m"
-                    f"Retrying in {backoff} seconds...")
-                time.sleep(backoff)
-                retry_count += 1
-                backoff *= 2
-            elif error_code == "23505":  # Duplicate key error
-                print(f"\033[0;33mError 23505: Duplicate GUID detected in `{section}` on page {page}. "
-                      f"Skipping entry.\033[0m")
-                return False
-            elif error_code == "520":  # JSON could not be generated
-                print(
-                    f"\033[0;33mError 520: JSON object could not be generated for `{section}` on page {page}."
-                    f"Object is too large...\033[0m")
-                return False
-            elif error_code == "21000":  # ON CONFLICT DO UPDATE affecting row twice
-                print(f"\033[0;33mError 21000: ON CONFLICT DO UPDATE command cannot affect row a second time. "
-                      f"Skipping entry.\033[0m")
-                return False
-            elif error_code == "23502":  # Missing GUID in entry
-                print(f"\033[0;33mError 23502: Missing GUID in entry. Skipping entry.\033[0m")
-                return False
-            else:
-                print(f"\033[0;33mUnexpected API error while upsert section `{section}` on page {page}:\033[0m\n{e}")
-                cont = input(f"\nPlease report: {e.code} as message: {e.hint}. "
-                             f"Type 'exit' to quit, or press ENTER to continue.\n > ")
-                if not cont.lower() == "exit":
-                    return False
-                sys.exit(f"\033[0;33mDB has been force closed with errors.\033[0m")
-        if retry_count >= max_retries:
-            print(f"Max retries reached for page {page} of section `{section}`. Skipping.")
-            return False
-
-    return False
+PARAMS = {
+    "select": "data",
+    "id": "",
+    "limit": 1
+}
 
 
-def scrape():
-    config = load_config(program_tools.CONFIG_FILE)
+class FetchError(RuntimeError):
+    """A page could not be fetched from the Ashes Codex API. `code` is what stopped it, as kept in a dead letter."""
 
-    if not Info.ashes_key or not Info.ashes_auth:
-        print("\033[0;33mAshes Key or Auth Token is missing. May be required in the future\033[0m\n")
+    def __init__(self, message: str, section: str = None, page: int = None, code: str = "fetch"):
+        super().__init__(message)
+        self.section = section
+        self.page = page
+        self.code = code
 
-    # Removed xp-tables. The data is all over the place, and has no structure. Lists, lists of objects, objects of list.
-    sections = config["SECTIONS"]
-
-    params = {
-        "select": "data",
-        "id": "",
-        "limit": 1
-    }
 
-    headers = {
+def _build_headers(config):
+    return {
         "apikey": Info.ashes_key or "no-api-key-needed",
         "Authorization": Info.ashes_auth or "Bearer none",
         "Accept": "application/json",
@@ -132,173 +59,527 @@ def scrape():
         "X-Request-Source": "Discord-Mutim@0001"
     }
 
-    for section in sections:
 
-        page = 1
+@dataclass
+class CodexApi:
+    """
+    Everything needed to fetch pages from the Ashes Codex API, shared by every section of a run. `gate` (the engine's
+    `slot`) is held around each HTTP request, and let go while a page waits out its backoff.
+    """
+    session: requests.Session
+    limiter: RateLimiter
+    headers: dict
+    cache: Optional[ResponseCache] = None
+    base_url: str = API_URL
+    timeout: float = 30
+    section_timeouts: dict = field(default_factory=lambda: {"npcs": 60})
+    gate: Callable[[], ContextManager] = nullcontext
+
+    @classmethod
+    def from_config(cls, config, gate=None) -> "CodexApi":
+        http_config = config.get("HTTP", {})
+        return cls(
+            session=program_tools.get_http_session(config),
+            limiter=RateLimiter.from_config(config),
+            headers=_build_headers(config),
+            cache=ResponseCache.from_config(config),
+            base_url=config.get("API_URL", API_URL).rstrip("/"),
+            timeout=float(http_config.get("TIMEOUT", cls.timeout)),
+            section_timeouts=http_config.get("SECTION_TIMEOUTS", {"npcs": 60}),
+            gate=gate or nullcontext
+        )
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+
+    def fetch_page(self, section, page, log):
+        """Fetch a single page of `section`, and return its `data` list. An empty list means there are no more pages."""
+        body = self.fetch_body(section, page, log)
+        with Metrics.time("codex_json_decode_seconds", section=section):
+            return codec_tools.loads(body).get("data", [])
+
+    def fetch_body(self, section, page, log) -> bytes:
+        """The raw response body of one page, from the cache when it has a fresh enough copy"""
+        cached = self.cache.get(section, page) if self.cache is not None else None
+        if cached is not None and self.cache.is_fresh(cached):
+            Metrics.inc("codex_cache_hits_total", section=section)
+            return cached.body
+        if self.cache is not None and self.cache.offline:
+            raise FetchError(f"Page {page} of section `{section}` is not in the cache, and the cache is offline.",
+                             section, page, "offline")
+
+        url = f"{self.base_url}/{section}?page={page}"
+        timeout_time = self.section_timeouts.get(section, self.timeout)
+        headers = self.headers
+        if cached is not None:
+            headers = {**self.headers, **self.cache.conditional_headers(cached)}
+
+        for attempt in range(self.limiter.attempts):
+            if attempt:
+                Metrics.inc("codex_http_retries_total", section=section)
+            self.limiter.acquire()
+            try:
+                with self.gate(), Metrics.time("codex_http_request_seconds", section=section):
+                    response = self.session.get(url, headers=headers, params=PARAMS, timeout=timeout_time)
+            except requests.exceptions.Timeout:
+                Metrics.inc("codex_http_timeouts_total", section=section)
+                delay = self.limiter.failure(attempt)
+                log(f"Request timed out on page {page} of section `{section}`. Retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
+                continue
 
-        print(f"---------- Starting Section `{section}` on page {page}. ----------")
+            Metrics.inc("codex_http_responses_total", section=section, status=response.status_code)
+            if response.status_code == 429:
+                Metrics.inc("codex_http_rate_limited_total", section=section)
+                pause = self.limiter.throttled(attempt, response.headers.get("Retry-After"))
+                log(f"Rate-limited. Retrying after {pause:.1f} seconds at {self.limiter.rate:.2f} requests/s...")
+                continue
+            if response.status_code >= 500:
+                delay = self.limiter.failure(attempt)
+                log(f"HTTP {response.status_code} on page {page} of section `{section}`. "
+                    f"Retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
+                continue
+            if response.status_code == 304 and cached is not None:
+                Metrics.inc("codex_cache_hits_total", section=section)
+                self.limiter.success()
+                self.cache.revalidated(section, page)
+                return cached.body
+            if response.status_code != 200:
+                raise FetchError(f"Error fetching section `{section}` page {page}: HTTP {response.status_code}",
+                                 section, page, f"HTTP {response.status_code}")
+
+            self.limiter.success()
+            body = response.content
+            # `raw.tell()` counts the bytes that came over the wire, before any Content-Encoding was undone
+            Metrics.inc("codex_http_body_bytes_total", len(body), section=section)
+            Metrics.inc("codex_http_wire_bytes_total", response.raw.tell() or len(body), section=section)
+            if self.cache is not None:
+                self.cache.put(section, page, body, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+            return body
+
+        raise FetchError(f"Failed after {self.limiter.attempts} attempts on page {page} of section `{section}`.",
+                         section, page, "max_retries")
+
+
+def _page_stages(section, engine, api, log, changes, references, tag_data=True, projection=None, stats=None):
+    """
+    The fetch and transform stages of a section's pipeline, as `(fetch, transform, prepare)` for `engine.pipeline()`.
+    With transform processes, pages are fetched as raw bytes, and decoding, building rows, projecting, hashing,
+    finding references and encoding the rows again all happen in `prepare_page()` on other cores. The rows stay
+    encoded on their way to the sink. Otherwise the transformer thread does it all. What the `projection` drops is
+    added up in `stats`.
+    """
+    def check_guids(entries):
+        for entry in entries:
+            if not entry.get('guid'):
+                log(f"Missing GUID in entry: {entry}")
+
+    def check_encoded_guids(rows):
+        missing = [i for i, guid in enumerate(rows.guids) if not guid]
+        if missing:
+            check_guids(rows.subset(missing))
+
+    def projected(page_stats):
+        if page_stats is not None:
+            stats.add(page_stats)
+            Metrics.inc("codex_projection_bytes_saved_total", page_stats.bytes, section=section)
+
+    if not engine.transform_processes:
+        def fetch(section_name, page):
+            return api.fetch_page(section_name, page, log)
+
+        def transform(page, new_data):
+            page_stats = ProjectionStats() if projection is not None else None
+            entries = transform_entries(section, new_data, tag_data, projection, page_stats)
+            projected(page_stats)
+            check_guids(entries)
+            if references is not None:
+                references.add(section, entries)
+            return changes.filter(page, entries)
+
+        return fetch, transform, None
+
+    def fetch(section_name, page):
+        body = api.fetch_body(section_name, page, log)
+        return None if is_empty_page(body) else body
+
+    def transform(page, prepared):
+        rows, hashes, indexed, page_stats = prepared
+        projected(page_stats)
+        check_encoded_guids(rows)
+        if references is not None:
+            references.add_indexed(*indexed)
+        return changes.filter(page, rows, hashes)
+
+    prepare = partial(prepare_page, tag_data=tag_data, hashes=changes.index is not None,
+                      references=references is not None, codec=codec_tools.backend(), projection=projection)
+    return fetch, transform, prepare
+
+
+@dataclass
+class _Run:
+    """What a run reads from and writes to, from `_open_run()`. `stack` closes anything else the run opens."""
+    sink: Sink
+    api: CodexApi
+    index: Optional[HashIndex]
+    references: Optional[ReferenceIndex]
+    stack: ExitStack
+
+
+@contextmanager
+def _open_run(config, method=None, output_dir="data", gate=None):
+    """
+    Open a run's sink, API client and the indexes turned on in config.json, and start the metrics exporters. All of
+    it is closed again on the way out, including what was already open when something after it failed to open.
+    """
+    with ExitStack() as stack:
+        sink = open_sink(config, method, output_dir)
+        stack.callback(sink.close)
+        api = CodexApi.from_config(config, gate)
+        stack.callback(api.close)
+        index = HashIndex.for_method(sink.method) if config.get("INCREMENTAL") else None
+        if index is not None:
+            stack.callback(index.close)
+        references = ReferenceIndex.from_config(config)
+        if references is not None:
+            stack.callback(references.close)
+        stack.callback(stop_exporters, start_exporters(config))
+        yield _Run(sink, api, index, references, stack)
+
+
+def _resume_message(progress):
+    pages = progress.checkpoint["pages"]
+    return f"Resuming from page {progress.start_page}. {len(pages)} pages were written by an earlier run."
+
+
+def _scrape_xp_tables(api, output_dir="data"):
+    """
+    xp-tables is one document of curves, not pages of entities. Whatever the scrape method, it skips the row pipeline
+    and is saved as arrays to `{output_dir}/xp-tables.npz`.
+    """
+    # Imported here, so runs without xp-tables never load NumPy
+    from tools.xp_tools import CurveTable
+
+    log = SectionLog(XP_SECTION)
+    log(f"---------- Starting Section `{XP_SECTION}`. ----------")
+    try:
+        table = CurveTable.from_document(codec_tools.loads(api.fetch_body(XP_SECTION, 1, log)))
+    except RuntimeError as e:
+        log(f"\033[0;31m{e} Skipping section `{XP_SECTION}`.\033[0m")
+        return False
+    path = os.path.join(output_dir, "xp-tables.npz")
+    table.save(path)
+    log(f"Saved {len(table.names)} curves for \033[0;32m`{XP_SECTION}`\033[0m to {path}. Section complete.")
+    return True
 
-        while True:
-            timeouts = 0
-            start_time = time.time()
-            url = f"https://api.ashescodex.com/{section}?page={page}"
-            timeout_time = 30
-            if section == "npcs":
-                timeout_time = 60
 
-            while timeouts <= 5:
-                try:
-                    response = requests.get(url, headers=headers, params=params, timeout=timeout_time)
+def _section_worker(api, output_dir, scrape_section):
+    """`scrape_section(section)` for every section but xp-tables, which has a scraper of its own"""
+    return lambda section: _scrape_xp_tables(api, output_dir) if section == XP_SECTION else scrape_section(section)
 
-                    if response.status_code == 429:
-                        retry_after = int(response.headers.get("Retry-After", 60))
-                        print(f"Rate-limited. Retrying after {retry_after} seconds...")
-                        time.sleep(retry_after)
-                        continue
-                    break
-                except requests.exceptions.Timeout:
-                    timeouts += 1
-                    print(f"Request timed out on page {page} of section `{section}`. Retrying in 5 seconds...")
-                    time.sleep(5)
-            else:
-                print(f"Failed after 5 timeouts on page {page} of section `{section}`. Skipping...")
-                continue
 
-            if response.status_code != 200:
-                print(f"Error fetching section `{section}`: HTTP {response.status_code}")
-                return
+def _scrape_section(section, engine, api, sink, checkpoints, index=None, references=None, projection=None):
+    log = SectionLog(section)
+    changes = SectionChanges(index, section)
+    progress = SectionProgress(checkpoints, section)
+    stats = ProjectionStats()
+    # An incremental run only holds new and changed entries, so a file sink writes it next to the full snapshot
+    writer = sink.open(section, log, progress, delta=index is not None)
 
-            json_data = response.json()
-            new_data = json_data.get("data", [])
+    log(f"---------- Starting Section `{section}` on page {progress.start_page}. ----------")
+    if progress.resumed:
+        log(_resume_message(progress))
 
-            if not new_data:
-                print(f"No more data found for `{section}`. Moving to next section...")
-                break
+    fetch, transform, prepare = _page_stages(section, engine, api, log, changes, references, sink.tag_data,
+                                             projection, stats)
 
-            entries = []
-            _slug_entries = ["mobs", "hunting-creatures"]
-            for entry in new_data:
-                if section in _slug_entries:
-                    guid = entry.get("_slug")
-                else:
-                    #  This is an ugly workaround. Will have to fix it when everything has a guid or _id
-                    guid = entry.get("guid") or entry.get("_id") or entry.get("displayName")
-
-                entry['guid'] = guid
-                entry['section'] = section
-
-                entries.append({
-                    "guid": guid,
-                    "section": section,
-                    "data": entry
-                })
-
-            # Insert data into Supabase. This will handle known error codes. Open a ticket if you find another code
-            # that should be handled
-            if entries:
-                for entry in entries:
-                    if not entry.get('guid'):
-                        print(f"Missing GUID in entry: {entry}")
-                success = retry_upsert(entries, section, page)
-                if not success:
-                    print(f"Failed to handle entries for section `{section}` page {page}.")
-
-            print(f"Inserting page \033[0;32m{page}\033[0m, section `{section}` data in {time.time() - start_time:.2f} seconds.")
-            page += 1
-            time.sleep(0.25)
-    input("\033[0;32mData Grabbing Complete!  --  Press ENTER to return to Main Menu...\033[0m\n")
-
-
-def scrape_to_json():
-    config = load_config(program_tools.CONFIG_FILE)
-    output_dir = "data"
+    def saved(pages):
+        for page, stored in pages:
+            if stored:
+                changes.written(page)
+            else:
+                log(f"Failed to handle entries for section `{section}` page {page}.")
+            progress.advance(page, **writer.checkpoint)
+
+    def write(page, entries):
+        saved(writer.write_batch(page, entries))
+
+    try:
+        engine.pipeline(section, fetch, transform, write, log, start=progress.start_page, prepare=prepare)
+        saved(writer.flush())
+    except FetchError as e:
+        writer.close(finished=False)
+        if sink.dead_letters is not None and e.page is not None:
+            sink.dead_letters.add_page(section, e.page, e.code, str(e))
+        log(f"\033[0;31m{e} Skipping section `{section}`. The next run resumes from page {progress.start_page}.\033[0m")
+        return False
+    except ScrapeStopped:
+        writer.close(finished=False)
+        log(f"\033[0;33mStopped section `{section}`. The next run resumes from page {progress.start_page}.\033[0m")
+        return False
+    except BaseException:
+        writer.close(finished=False)
+        raise
+    finally:
+        if index is not None:
+            log(f"Incremental | {changes.summary()}")
+        if projection is not None:
+            log(f"Projection | {stats.summary()}")
+
+    result = writer.close()
+    progress.finish()
+    log(f"No more data found for `{section}`. Section complete.")
+    return result
+
+
+def run_scrape(config=None, method=None, output_dir="data", interactive=True):
+    """
+    Scrape every configured section into the sink for `method`, SCRAPE_METHOD in config.json by default (see
+    tools/sink_tools.py). File sinks write under `output_dir`. Pass `config` to override config.json, and
+    `interactive=False` to skip the closing prompt. Returns the engine's per-section stats.
+    """
+    config = config or load_config(program_tools.CONFIG_FILE)
+    codec_tools.set_backend(config.get("JSON_CODEC", "auto"))
 
     if not Info.ashes_key or not Info.ashes_auth:
         print("\033[0;33mAshes Key or Auth Token is missing. May be required in the future\033[0m\n")
 
-    os.makedirs(output_dir, exist_ok=True)
-
     sections = config["SECTIONS"]
-    params = {
-        "select": "data",
-        "id": "",
-        "limit": 1
-    }
-
-    headers = {
-        "apikey": Info.ashes_key or "no-api-key-needed",
-        "Authorization": Info.ashes_auth or "Bearer none",
-        "Accept": "application/json",
-        "User-Agent": f"CodexScraper/{config['VERSION']}",
-        "X-Request-Source": "Discord-Mutim@0001"
-    }
-
-    for section in sections:
-        page = 1
-        all_section_data = []
-        print(f"---------- Starting Section `{section}` on page {page}. ----------")
+    engine = Engine.from_config(config)
+    with _open_run(config, method, output_dir, gate=engine.slot) as run:
+        sink = run.sink
+        checkpoints = Checkpoints(sink.method)
+        engine.run_sections(sections, _section_worker(
+            run.api, sink.output_dir,
+            lambda section: _scrape_section(section, engine, run.api, sink, checkpoints, run.index, run.references,
+                                            Projection.from_config(config, section))
+        ))
+
+    print(f"\n\033[0;32mScraping complete! Saved to {sink.destination}\033[0m")
+    if interactive:
+        input("Press ENTER to return to main menu...")
+    return engine.stats
+
+
+def scrape(config=None, interactive=True):
+    """Scrape every configured section into the database. See `run_scrape()`."""
+    return run_scrape(config, "DB", interactive=interactive)
+
+
+def scrape_to_json(config=None, output_dir="data", interactive=True):
+    """Scrape every configured section into JSON files under `output_dir`. See `run_scrape()`."""
+    return run_scrape(config, "JSON", output_dir, interactive)
+
+
+def scrape_to_parquet(config=None, output_dir="data", interactive=True):
+    """Scrape every configured section into Parquet datasets under `output_dir/parquet`. See `run_scrape()`."""
+    return run_scrape(config, "PARQUET", output_dir, interactive)
+
+
+def scrape_to_sqlite(config=None, interactive=True):
+    """
+    Scrape every configured section into the local SQLite mirror (`SQLITE.PATH`, data/codex.sqlite by default).
+    See `run_scrape()`.
+    """
+    return run_scrape(config, "SQLITE", interactive=interactive)
+
+
+def seed_queue(config=None, queue_path=None, reset=False):
+    """
+    Find the last page of every configured section, and queue every page for `scrape_from_queue()` workers.
+    Pages already queued are kept, so seeding again only adds new pages. `reset` drops every task first.
+    Returns `{section: pages queued}`.
+    """
+    config = config or load_config(program_tools.CONFIG_FILE)
+    codec_tools.set_backend(config.get("JSON_CODEC", "auto"))
+    engine = Engine.from_config(config)
+    api = CodexApi.from_config(config, gate=engine.slot)
+    queue = WorkQueue.from_config(config, queue_path)
+    if reset:
+        queue.clear()
+
+    def seed_section(section):
+        log = SectionLog(section)
+        if section == XP_SECTION:
+            pages = range(1, 2)
+        else:
+            try:
+                last_page, _ = engine.discover_last_page(section, lambda name, page: api.fetch_page(name, page, log))
+            except FetchError as e:
+                log(f"\033[0;31m{e} Skipping section `{section}`.\033[0m")
+                return 0
+            pages = range(1, last_page + 1)
+        added = queue.add(section, pages)
+        log(f"Queued {added} new of {len(pages)} pages.")
+        return len(pages)
 
-        while True:
-            timeouts = 0
-            start_time = time.time()
-            url = f"https://api.ashescodex.com/{section}?page={page}"
-            timeout_time = 30
-            if section == "npcs":
-                timeout_time = 60
+    try:
+        return engine.run_sections(config["SECTIONS"], seed_section)
+    finally:
+        api.close()
+        queue.close()
+
+
+def scrape_from_queue(config=None, queue_path=None, shard=None, worker="worker"):
+    """
+    Lease pages from the work queue (see tools/queue_tools.py) and scrape them, `CONCURRENCY.REQUESTS` at a time, until
+    none are left. Start as many workers as you like on one queue. `shard` is `(i, n)`, to only take that share of the
+    tasks. Pages are written as they finish, in no particular order, so this needs an unordered sink (DB or SQLITE).
+    Returns `{"done": pages, "failed": pages}` for this worker.
+    """
+    config = config or load_config(program_tools.CONFIG_FILE)
+    codec_tools.set_backend(config.get("JSON_CODEC", "auto"))
+    method = config.get("SCRAPE_METHOD", "DB").upper()
+    if sink_class(method).ordered:
+        raise ValueError(f"The work queue writes pages out of order, which the {method} method can't take. "
+                         f"Set SCRAPE_METHOD to one that writes page by page, like DB or SQLITE.")
+
+    engine = Engine.from_config(config)
+    counts = {"done": 0, "failed": 0}
+    counts_lock = threading.Lock()
+    with _open_run(config, method, gate=engine.slot) as run:
+        sink, api, index, references = run.sink, run.api, run.index, run.references
+        queue = run.stack.enter_context(closing(WorkQueue.from_config(config, queue_path)))
+
+        def run_task(section, page) -> bool:
+            if section == XP_SECTION:
+                return _scrape_xp_tables(api, sink.output_dir)
+            log = SectionLog(section)
+            changes = SectionChanges(index, section)
+            projection = Projection.from_config(config, section)
+            stats = ProjectionStats() if projection is not None else None
+            entries = transform_entries(section, api.fetch_page(section, page, log), sink.tag_data, projection, stats)
+            if stats is not None:
+                Metrics.inc("codex_projection_bytes_saved_total", stats.bytes, section=section)
+            if references is not None:
+                references.add(section, entries)
+            entries = changes.filter(page, entries)
+            if not all(stored for _, stored in sink.open(section, log).write_batch(page, entries)):
+                return False
+            changes.written(page)
+            return True
 
-            while timeouts <= 5:
+        def work():
+            while not engine.stopped:
+                task = queue.lease(worker, shard)
+                if task is None:
+                    if not queue.remaining(shard):
+                        return
+                    # Other workers hold the rest, or they are waiting to be retried. A dead worker's lease runs out.
+                    time.sleep(1)
+                    continue
+                section, page = task
                 try:
-                    response = requests.get(url, headers=headers, params=params, timeout=timeout_time)
+                    error = None if run_task(section, page) else "Failed to write the page"
+                except Exception as e:
+                    error = e
+                if error is None:
+                    queue.done(section, page)
+                elif queue.fail(section, page, error):
+                    if sink.dead_letters is not None:
+                        sink.dead_letters.add_page(section, page, getattr(error, "code", "max_attempts"), str(error))
+                    SectionLog(section)(f"\033[0;31mPage {page} failed for good, and is dead-lettered: {error}\033[0m")
+                else:
+                    SectionLog(section)(f"\033[0;33mPage {page} failed, it will be retried: {error}\033[0m")
+                with counts_lock:
+                    counts["done" if error is None else "failed"] += 1
+
+        print(f"Worker `{worker}` started{f' on shard {shard[0]}/{shard[1]}' if shard else ''}. "
+              f"{queue.remaining(shard)} pages to go.")
+        with ThreadPoolExecutor(max_workers=engine.max_requests, thread_name_prefix="queue") as pool:
+            workers = [pool.submit(work) for _ in range(engine.max_requests)]
+            try:
+                for future in workers:
+                    future.result()
+            except KeyboardInterrupt:
+                # Leased pages go back to the queue when their lease runs out
+                engine.stop()
+                raise
+
+    print(f"\n\033[0;32mWorker `{worker}` finished: {counts['done']} pages done, "
+          f"{counts['failed']} failed attempts.\033[0m")
+    return counts
+
+
+def replay_dead_letters(config=None, method=None, section=None, include_failed=False, wait=False):
+    """
+    Retry only what a scrape with `method` (SCRAPE_METHOD by default) dead-lettered, see tools/deadletter_tools.py.
+    Pages that could not be fetched are fetched and written again, and rows that could not be written are written
+    again as they were. A page that fails again is put back with its own backoff, `DEAD_LETTERS.RETRY_DELAY` doubling
+    until `MAX_ATTEMPTS`. `include_failed` gives letters that used up their attempts one more try, and with `wait`
+    it sleeps through the backoff until nothing is left to retry. Returns `{"replayed": pages, "failed": pages}`.
+    """
+    config = config or load_config(program_tools.CONFIG_FILE)
+    codec_tools.set_backend(config.get("JSON_CODEC", "auto"))
+    method = (method or config.get("SCRAPE_METHOD", "DB")).upper()
+    if sink_class(method).ordered:
+        raise ValueError(f"The {method} method picks a failed page back up from its checkpoint, so it keeps no dead "
+                         f"letters. Run the scrape again to resume it.")
+
+    counts = {"replayed": 0, "failed": 0}
+    projection_stats = {}
+    with _open_run(config, method) as run:
+        sink, api, index, references = run.sink, run.api, run.index, run.references
+        dead_letters = sink.dead_letters
+        if dead_letters is None:
+            raise ValueError("Dead letters are turned off. Set DEAD_LETTERS.ENABLED in config.json.")
+
+        def replay(section_name, page, rows) -> bool:
+            if section_name == XP_SECTION:
+                return _scrape_xp_tables(api, sink.output_dir)
+            log = SectionLog(section_name)
+            changes = SectionChanges(index, section_name)
+            if rows is None:
+                projection = Projection.from_config(config, section_name)
+                stats = ProjectionStats() if projection is not None else None
+                rows = transform_entries(section_name, api.fetch_page(section_name, page, log), sink.tag_data,
+                                         projection, stats)
+                if stats is not None:
+                    projection_stats.setdefault(section_name, ProjectionStats()).add(stats)
+                    Metrics.inc("codex_projection_bytes_saved_total", stats.bytes, section=section_name)
+                if references is not None:
+                    references.add(section_name, rows)
+            rows = changes.filter(page, rows)
+            if not all(stored for _, stored in sink.open(section_name, log).write_batch(page, rows)):
+                return False
+            changes.written(page)
+            return True
 
-                    if response.status_code == 429:
-                        retry_after = int(response.headers.get("Retry-After", 60))
-                        print(f"Rate-limited. Retrying after {retry_after} seconds...")
-                        time.sleep(retry_after)
+        try:
+            while True:
+                for section_name, page, rows in dead_letters.due(section, include_failed):
+                    log = SectionLog(section_name)
+                    what = f"page {page}" if rows is None else f"{len(rows)} entries of page {page}"
+                    try:
+                        # A write that fails again has already updated its letters' error codes
+                        stored, error = replay(section_name, page, rows), None
+                    except FetchError as e:
+                        log(f"\033[0;33m{e}\033[0m")
+                        stored, error = False, e.code
+                    if stored:
+                        dead_letters.resolve(section_name, page)
+                        counts["replayed"] += 1
+                        log(f"Replayed {what}.")
                         continue
+                    counts["failed"] += 1
+                    if dead_letters.retry_later(section_name, page, error):
+                        log(f"\033[0;31mReplay of {what} failed, and has used up its attempts.\033[0m")
+                    else:
+                        log(f"\033[0;33mReplay of {what} failed, it will be retried later.\033[0m")
+
+                # Letters that had used up their attempts get one more try, not a backoff of their own
+                include_failed = False
+                next_retry = dead_letters.next_retry(section)
+                if not wait or next_retry is None:
                     break
-                except requests.exceptions.Timeout:
-                    timeouts += 1
-                    print(f"Request timed out on page {page}. Retrying in 5 seconds...")
-                    time.sleep(5)
-            else:
-                print(f"\033[0;31mFailed after 5 timeouts. Skipping section `{section}`...\033[0m")
-                break
-
-            if response.status_code != 200:
-                print(f"\033[0;31mError fetching section `{section}`: HTTP {response.status_code}\033[0m")
-                break
-
-            json_data = response.json()
-            new_data = json_data.get("data", [])
-
-            if not new_data:
-                print(f"No more data found for `{section}` (page {page})\nWriting data, please wait...")
-                break
-
-            for entry in new_data:
-                if section in ["mobs", "hunting-creatures"]:
-                    guid = entry.get("_slug")
-                else:
-                    guid = entry.get("guid") or entry.get("_id") or entry.get("displayName")
-
-                processed_entry = {
-                    "guid": guid,
-                    "section": section,
-                    "data": entry
-                }
-                all_section_data.append(processed_entry)
-
-            print(f"Processed page \033[0;32m{page}\033[0m in {time.time() - start_time:.2f}s")
-            page += 1
-            time.sleep(0.25)
-
-        if all_section_data:
-            fname = f"{output_dir}/{section}.json"
-            with open(fname, 'w', encoding='utf-8') as f:
-                json.dump(all_section_data, f, indent=2, ensure_ascii=False)
-            print(f"\033[0;32mSaved {len(all_section_data)} entries to {fname}\033[0m")
-        else:
-            print(f"\033[0;33mNo data saved for section `{section}`\033[0m")
-
-    print(f"\n\033[0;32mScraping complete! JSON files saved to {output_dir}/\033[0m")
-    input("Press ENTER to return to main menu...")
+                pause = max(0.0, next_retry - time.time())
+                print(f"Waiting {pause:.0f} seconds for the next retry...")
+                time.sleep(pause)
+        finally:
+            for section_name, stats in projection_stats.items():
+                SectionLog(section_name)(f"Projection | {stats.summary()}")
+
+    print(f"\n\033[0;32mReplay finished: {counts['replayed']} pages replayed, {counts['failed']} failed.\033[0m")
+    return counts
@@ -0,0 +1,139 @@
+"""
+Turning API pages into `codex` rows. `prepare_page()` does the whole CPU-bound part of that for one raw page, and is
+what the engine's transform processes run when `CONCURRENCY.TRANSFORM_PROCESSES` is set.
+"""
+from tools import codec_tools
+from tools.projection_tools import ProjectionStats
+from tools.reference_tools import description, display_name, index_rows
+from tools.state_tools import content_hash
+
+__all__ = (
+    'SLUG_SECTIONS',
+    'XP_SECTION',
+    'EncodedRows',
+    'entry_guid',
+    'is_empty_page',
+    'prepare_page',
+    'transform_entries'
+)
+
+# These sections have no guid, and are keyed on `_slug` instead
+SLUG_SECTIONS = ["mobs", "hunting-creatures"]
+
+# A document of curves rather than pages of entities. tools/xp_tools.py reads it.
+XP_SECTION = "xp-tables"
+
+# An empty page is `{"data": []}`. Anything bigger than this has entries, and doesn't need decoding to find out.
+_EMPTY_PAGE_BYTES = 1024
+
+
+def entry_guid(section, entry):
+    if section in SLUG_SECTIONS:
+        return entry.get("_slug")
+    #  This is an ugly workaround. Will have to fix it when everything has a guid or _id
+    return entry.get("guid") or entry.get("_id") or entry.get("displayName")
+
+
+def transform_entries(section, new_data, tag_data=True, projection=None, stats=None):
+    """
+    Turn one page of API data into `codex` rows. With `tag_data`, the guid and section are also stored in `data`.
+    A `projection` cuts each entity down once its guid is known, and adds what it dropped to `stats`.
+    """
+    entries = []
+    for entry in new_data:
+        guid = entry_guid(section, entry)
+        if projection is not None:
+            entry = projection.apply(entry, stats)
+
+        if tag_data:
+            entry['guid'] = guid
+            entry['section'] = section
+
+        entries.append({
+            "guid": guid,
+            "section": section,
+            "data": entry
+        })
+    return entries
+
+
+class EncodedRows:
+    """
+    A page of `codex` rows as a transform process hands them back: each row's guid, and its `data` already encoded as
+    compact JSON, along with its name and description. Sinks that store JSON text (JSON files, COPY, SQLite) write
+    `data` as it is. Anything else iterates, indexes or slices it like a list of row dicts, which are decoded the
+    first time they are asked for.
+    """
+
+    def __init__(self, section: str, guids: list, data: list, names: list, descriptions: list):
+        self.section = section
+        self.guids = guids
+        self.data = data
+        self.names = names
+        self.descriptions = descriptions
+        self._entries = None
+
+    @classmethod
+    def from_entries(cls, section: str, entries: list) -> "EncodedRows":
+        return cls(section, [entry["guid"] for entry in entries],
+                   [codec_tools.dumps(entry["data"]) for entry in entries],
+                   [display_name(entry["data"]) for entry in entries],
+                   [description(entry["data"]) for entry in entries])
+
+    def subset(self, indices) -> "EncodedRows":
+        """The rows at `indices`, still encoded"""
+        indices = list(indices)
+        return EncodedRows(self.section, [self.guids[i] for i in indices], [self.data[i] for i in indices],
+                           [self.names[i] for i in indices], [self.descriptions[i] for i in indices])
+
+    def row_bytes(self):
+        """Each row as compact JSON, the same bytes `codec_tools.dumps(row)` gives for the decoded row"""
+        section = codec_tools.dumps(self.section)
+        for guid, data in zip(self.guids, self.data):
+            yield b'{"guid":' + codec_tools.dumps(guid) + b',"section":' + section + b',"data":' + data + b'}'
+
+    def entries(self) -> list:
+        if self._entries is None:
+            self._entries = [{"guid": guid, "section": self.section, "data": codec_tools.loads(data)}
+                             for guid, data in zip(self.guids, self.data)]
+        return self._entries
+
+    def __len__(self):
+        return len(self.guids)
+
+    def __iter__(self):
+        return iter(self.entries())
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.subset(range(*key.indices(len(self))))
+        return self.entries()[key]
+
+    def __getstate__(self):
+        # Decoded rows are never sent between processes
+        return {**self.__dict__, "_entries": None}
+
+
+def is_empty_page(body: bytes) -> bool:
+    """Whether a raw page is the empty one that ends a section"""
+    return len(body) <= _EMPTY_PAGE_BYTES and not codec_tools.loads(body).get("data")
+
+
+def prepare_page(section: str, body: bytes, tag_data: bool = True, hashes: bool = False, references: bool = False,
+                 codec: str = None, projection=None) -> tuple:
+    """
+    Decode a raw page, build its rows, and project, hash and index them if asked. Runs in a worker process.
+
+    Returns `(rows, hashes, references, stats)`. `rows` is the page's EncodedRows, so the parent can filter and write
+    them without decoding them again, and no tree of dicts is pickled. `hashes` is guid -> content hash for
+    `SectionChanges.filter()`, `references` is `(entities, edges)` for `ReferenceIndex.add_indexed()`, and `stats` is
+    the `projection`'s ProjectionStats. Each is None when not asked for. `codec` is the parent's JSON backend, as a
+    fresh worker process starts on the default, and the rows must be encoded the way the parent would encode them.
+    """
+    if codec and codec_tools.backend() != codec:
+        codec_tools.set_backend(codec)
+    stats = ProjectionStats() if projection is not None else None
+    rows = transform_entries(section, codec_tools.loads(body).get("data", []), tag_data, projection, stats)
+    row_hashes = {row["guid"]: content_hash(row["data"]) for row in rows if row.get("guid")} if hashes else None
+    indexed = index_rows(section, rows) if references else None
+    return EncodedRows.from_entries(section, rows), row_hashes, indexed, stats
@@ -0,0 +1,220 @@
+"""
+XP tables. The `xp-tables` endpoint isn't paged like the other sections: it is one document of Unreal curves
+(`levelUpCurve.editorCurveData.keys`, `Properties.FloatCurve.Keys`, ...), each a list of time/value keys. Every curve
+is flattened into NumPy arrays and saved as one `.npz` file, and looked up many values at a time.
+
+    python -m tools.xp_tools list
+    python -m tools.xp_tools xp 10 20 25                                  # XP needed for each level
+    python -m tools.xp_tools level 150000 2000000 --curve craftingXpCurve  # level reached with each XP total
+"""
+import argparse
+import os
+from dataclasses import dataclass
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from tools.transform_tools import XP_SECTION
+
+__all__ = (
+    'XP_SECTION',
+    'XP_TABLES_PATH',
+    'Curve',
+    'CurveTable',
+    'extract_curves'
+)
+
+XP_TABLES_PATH = os.path.join("data", "xp-tables.npz")
+
+# The curve looked up when none is named
+DEFAULT_CURVE = "levelXpCurve/levelUpCurve"
+
+# How the curve moves from one key to the next. Cubic keys are evaluated as linear: every key the API serves is linear,
+# and linear keeps the level <-> XP lookup exactly invertible.
+LINEAR, CONSTANT = 0, 1
+_INTERP_MODES = {"RCIM_Linear": LINEAR, "RCIM_Cubic": LINEAR, "RCIM_Constant": CONSTANT, "RCIM_None": CONSTANT}
+
+# Path segments that only wrap a key list, and are left out of curve names
+_WRAPPERS = {"editorCurveData", "keys", "Properties", "FloatCurve", "Keys"}
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("XP tables need the `numpy` package: pip install numpy")
+
+
+def _key(key: dict, field: str):
+    # editorCurveData keys are camelCase, exported CurveFloat keys are PascalCase
+    return key.get(field, key.get(field[0].upper() + field[1:]))
+
+
+def _is_key_list(value) -> bool:
+    return (isinstance(value, list) and bool(value) and isinstance(value[0], dict)
+            and _key(value[0], "time") is not None and _key(value[0], "value") is not None)
+
+
+@dataclass
+class Curve:
+    """
+    One curve as arrays. `modes[i]` is how the curve gets from key `i` to key `i + 1`.
+    Outside its keys, a curve holds its first or last value, the same as in the game.
+    """
+    name: str
+    times: "np.ndarray"
+    values: "np.ndarray"
+    modes: "np.ndarray"
+
+    @classmethod
+    def from_keys(cls, name: str, keys: list) -> "Curve":
+        _require_numpy()
+        times = np.array([float(_key(key, "time")) for key in keys], dtype=np.float64)
+        values = np.array([float(_key(key, "value")) for key in keys], dtype=np.float64)
+        modes = np.array([_INTERP_MODES.get(_key(key, "interpMode"), LINEAR) for key in keys], dtype=np.uint8)
+        order = np.argsort(times, kind="stable")
+        return cls(name, times[order], values[order], modes[order])
+
+    def _segments(self, positions, keys):
+        # The segment each position falls in, by the key it starts at
+        return np.clip(np.searchsorted(keys, positions, side="right") - 1, 0, max(len(keys) - 2, 0))
+
+    def evaluate(self, times) -> "np.ndarray":
+        """The curve's value at each of `times` (for a level curve, the XP each level needs)"""
+        times = np.asarray(times, dtype=np.float64)
+        if len(self.times) == 1:
+            return np.full(times.shape, self.values[0])
+        i = self._segments(times, self.times)
+        t0, t1, v0, v1 = self.times[i], self.times[i + 1], self.values[i], self.values[i + 1]
+        span = t1 - t0
+        alpha = np.clip((times - t0) / np.where(span > 0, span, 1.0), 0.0, 1.0)
+        result = np.where(self.modes[i] == CONSTANT, v0, v0 + alpha * (v1 - v0))
+        return np.where(times >= self.times[-1], self.values[-1], result)
+
+    @property
+    def invertible(self) -> bool:
+        return len(self.values) > 1 and bool(np.all(np.diff(self.values) >= 0))
+
+    def invert(self, values) -> "np.ndarray":
+        """
+        Where the curve reaches each of `values` (for a level curve, the level each XP total gets you to). Fractional
+        on linear segments, so take `np.floor` for whole levels. Only for curves that never go down.
+        """
+        if not self.invertible:
+            raise ValueError(f"Curve `{self.name}` goes down somewhere, so it can't be inverted")
+        values = np.asarray(values, dtype=np.float64)
+        i = self._segments(values, self.values)
+        t0, t1, v0, v1 = self.times[i], self.times[i + 1], self.values[i], self.values[i + 1]
+        rise = v1 - v0
+        alpha = np.clip((values - v0) / np.where(rise > 0, rise, 1.0), 0.0, 1.0)
+        result = np.where((self.modes[i] == CONSTANT) | (rise <= 0), t0, t0 + alpha * (t1 - t0))
+        return np.where(values >= self.values[-1], self.times[-1], result)
+
+
+def extract_curves(document) -> dict:
+    """
+    Every curve in an xp-tables document, by path: `levelXpCurve/levelUpCurve`, `craftingXpCurve`,
+    `weaponXpCurve/Weapon_2H_Sword/experienceDecayCurve`, ...
+    """
+    curves = {}
+    stack = [(document, ())]
+    while stack:
+        value, path = stack.pop()
+        if _is_key_list(value):
+            name = "/".join(part for part in path if part not in _WRAPPERS)
+            curves[name] = Curve.from_keys(name, value)
+        elif isinstance(value, dict):
+            stack.extend((child, (*path, str(key))) for key, child in value.items())
+        elif isinstance(value, list):
+            # A list holding a single curve object is named after its parent
+            stack.extend((child, path if len(value) == 1 else (*path, str(i))) for i, child in enumerate(value))
+    return dict(sorted(curves.items()))
+
+
+class CurveTable:
+    """
+    Every XP curve, stored column-wise: all keys' times, values and modes end to end in three arrays, with `offsets`
+    marking where each curve starts. Saved as an uncompressed `.npz`, so loading it is a few reads.
+    """
+
+    def __init__(self, curves: dict):
+        _require_numpy()
+        self.curves = curves
+
+    @classmethod
+    def from_document(cls, document) -> "CurveTable":
+        return cls(extract_curves(document))
+
+    @property
+    def names(self) -> list:
+        return list(self.curves)
+
+    def curve(self, name: str = DEFAULT_CURVE) -> Curve:
+        if name not in self.curves:
+            raise KeyError(f"No curve named `{name}`. Expected one of: {', '.join(self.curves)}")
+        return self.curves[name]
+
+    def xp_for_level(self, levels, curve: str = DEFAULT_CURVE) -> "np.ndarray":
+        """Total XP needed to reach each of `levels`"""
+        return self.curve(curve).evaluate(levels)
+
+    def level_for_xp(self, xp, curve: str = DEFAULT_CURVE) -> "np.ndarray":
+        """The level each of `xp` totals reaches. Fractional between levels."""
+        return self.curve(curve).invert(xp)
+
+    def save(self, path: str = XP_TABLES_PATH):
+        curves = list(self.curves.values())
+        offsets = np.cumsum([0] + [len(curve.times) for curve in curves], dtype=np.int64)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temp_path = f"{path}.tmp.npz"
+        np.savez(temp_path,
+                 names=np.array(self.names, dtype=str),
+                 offsets=offsets,
+                 times=np.concatenate([curve.times for curve in curves]) if curves else np.empty(0),
+                 values=np.concatenate([curve.values for curve in curves]) if curves else np.empty(0),
+                 modes=np.concatenate([curve.modes for curve in curves]) if curves else np.empty(0, np.uint8))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str = XP_TABLES_PATH) -> "CurveTable":
+        _require_numpy()
+        with np.load(path, allow_pickle=False) as arrays:
+            names, offsets = arrays["names"], arrays["offsets"]
+            times, values, modes = arrays["times"], arrays["values"], arrays["modes"]
+        return cls({str(name): Curve(str(name), times[start:end], values[start:end], modes[start:end])
+                    for name, start, end in zip(names, offsets[:-1], offsets[1:])})
+
+
+def _format(number: float) -> str:
+    return f"{number:,.0f}" if float(number).is_integer() else f"{number:,.2f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Look up levels and XP in the scraped XP tables")
+    parser.add_argument("--path", default=XP_TABLES_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="every curve and its range")
+    for command, help_text, argument in (("xp", "XP needed for each level", "levels"),
+                                         ("level", "level reached with each XP total", "xp")):
+        lookup = commands.add_parser(command, help=help_text)
+        lookup.add_argument(argument, nargs="+", type=float)
+        lookup.add_argument("--curve", default=DEFAULT_CURVE)
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.path):
+        raise SystemExit(f"No XP tables at {args.path}. Add xp-tables to your sections and scrape first.")
+    table = CurveTable.load(args.path)
+    if args.command == "list":
+        for name, curve in table.curves.items():
+            print(f"{name:<60} {len(curve.times):>3} keys  {_format(curve.times[0])}-{_format(curve.times[-1])}  "
+                  f"{_format(curve.values[0])} -> {_format(curve.values[-1])}")
+    elif args.command == "xp":
+        for level, xp in zip(args.levels, table.xp_for_level(args.levels, args.curve)):
+            print(f"Level {_format(level):>6}  {_format(xp):>16} XP")
+    else:
+        for xp, level in zip(args.xp, table.level_for_xp(args.xp, args.curve)):
+            print(f"{_format(xp):>16} XP  Level {level:.2f}")
+
+
+if __name__ == "__main__":
+    main()